@@ -3,6 +3,8 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from routers.routing import router
 from services.data_loader import data_store
+from services.geo_kernels import warmup as warmup_geo_kernels
+from services.route_pool import start_route_executor, shutdown_route_executor
 
 app = FastAPI(title="Planning Service API", description="Prototype GIS planning backend for last-mile fiber routing")
 
@@ -15,10 +17,17 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Load data into memory at startup
+# Load data into memory at startup. Run `python -m services.data_loader` as a
+# prestart step so the graph cache already exists and startup only maps it.
 @app.on_event("startup")
 def startup_event():
+    warmup_geo_kernels()
     data_store.load_data()
+    start_route_executor()
+
+@app.on_event("shutdown")
+def shutdown_event():
+    shutdown_route_executor()
 
 # Include routers
 app.include_router(router)
@@ -3,8 +3,9 @@ import logging
 from fastapi import APIRouter, HTTPException
 from fastapi.responses import JSONResponse
 from models.schemas import RouteResponse, ComputeRouteRequest
-from services.data_loader import data_store
+from services.data_loader import data_store, NoPathError
 from services.cost_service import calculate_cost
+from services.route_pool import run_shortest_path
 
 # Configure logging
 logging.basicConfig(
@@ -37,21 +38,8 @@ def get_gp_boundary():
 def get_infra_nodes():
     return data_store.infra_nodes
 
-import networkx as nx
-from math import radians, sin, cos, sqrt, atan2
-
-def haversine(lon1, lat1, lon2, lat2):
-    R = 6371000  # radius of Earth in meters
-    phi1 = radians(lat1)
-    phi2 = radians(lat2)
-    delta_phi = radians(lat2 - lat1)
-    delta_lambda = radians(lon2 - lon1)
-    a = sin(delta_phi / 2.0) ** 2 + cos(phi1) * cos(phi2) * sin(delta_lambda / 2.0) ** 2
-    c = 2 * atan2(sqrt(a), sqrt(1 - a))
-    return R * c
-
 @router.post("/compute-route", response_model=RouteResponse)
-def compute_route(request: ComputeRouteRequest):
+async def compute_route(request: ComputeRouteRequest):
     start_time = time.time()
     logger.info(f"Compute route requested: infra_id={request.infra_id}, customer_lat={request.customer_lat}, customer_lng={request.customer_lng}")
     
@@ -68,7 +56,7 @@ def compute_route(request: ComputeRouteRequest):
         logger.error("Network graph is empty")
         return JSONResponse(status_code=500, content={"error": "Road network graph is not available"})
 
-    infra = next((i for i in data_store.infra_nodes if i.get("id") == request.infra_id), None)
+    infra = data_store.infra_by_id.get(request.infra_id)
     if not infra:
         logger.error(f"Infrastructure node not found: {request.infra_id}")
         return JSONResponse(status_code=404, content={"error": "Infrastructure node not found"})
@@ -77,31 +65,26 @@ def compute_route(request: ComputeRouteRequest):
     infra_lat = infra.get("latitude", infra.get("lat"))
     cust_lon, cust_lat = request.customer_lng, request.customer_lat
     
-    start_node = data_store.snap_to_graph(infra_lon, infra_lat)
-    end_node = data_store.snap_to_graph(cust_lon, cust_lat)
+    # Snap both endpoints with a single BallTree query
+    snapped, snap_idx = data_store.snap_many([[infra_lon, infra_lat], [cust_lon, cust_lat]])
     
-    if not start_node or not end_node:
+    if not snapped.all():
         logger.error("Could not snap points to road network graph")
         return JSONResponse(status_code=404, content={"error": "Could not snap points to road network graph"})
         
     try:
-        path = nx.shortest_path(data_store.graph, source=start_node, target=end_node, weight='weight')
-    except nx.NetworkXNoPath:
+        # CPU-bound search runs in the worker process pool so the event loop stays free;
+        # workers take and return graph node indices
+        path, total_dist = await run_shortest_path(request.infra_id, snap_idx[0], snap_idx[1])
+    except NoPathError:
         logger.error("No path found between the points")
         return JSONResponse(status_code=404, content={"error": "No path found between the points"})
     except Exception as e:
         logger.error(f"Internal calculation error: {str(e)}")
         return JSONResponse(status_code=500, content={"error": "Internal server error occurred while computing route"})
         
-    # calculate exact metric length using haversine on the path segments
-    total_dist = 0.0
-    for i in range(len(path) - 1):
-        u = path[i]
-        v = path[i+1]
-        total_dist += haversine(u[0], u[1], v[0], v[1])
-        
-    # Route response format: route: [ [lat, lng], ... ] we stored (lon, lat) in nodes
-    formatted_route = [[node[1], node[0]] for node in path]
+    # Route response format: route: [ [lat, lng], ... ]
+    formatted_route = data_store.route_latlng(path)
     
     estimated_cost = calculate_cost(total_dist)
     execution_time = round(time.time() - start_time, 3)
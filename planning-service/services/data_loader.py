@@ -1,34 +1,74 @@
 import json
 import os
+import pickle
 import geopandas as gpd
-from shapely.geometry import Point, LineString
+import numpy as np
+from sklearn.neighbors import BallTree
 import networkx as nx
-from math import radians, sin, cos, sqrt, atan2
-
-def haversine(lon1, lat1, lon2, lat2):
-    # Calculate distance between two points in meters using Haversine formula
-    R = 6371000  # radius of Earth in meters
-    phi1 = radians(lat1)
-    phi2 = radians(lat2)
-    delta_phi = radians(lat2 - lat1)
-    delta_lambda = radians(lon2 - lon1)
-    a = sin(delta_phi / 2.0) ** 2 + cos(phi1) * cos(phi2) * sin(delta_lambda / 2.0) ** 2
-    c = 2 * atan2(sqrt(a), sqrt(1 - a))
-    return R * c
+import scipy.sparse as sp
+from scipy.sparse.csgraph import dijkstra
+from services.geo_kernels import EARTH_RADIUS_M, haversine_nb, segment_lengths_nb
+
+class NoPathError(Exception):
+    pass
+
+# Graph nodes are keyed by a single int packing the 6-decimal lon/lat grid
+# position (lon in the high 32 bits, lat in the low 32 bits).
+_COORD_SCALE = 1e6
+_LOW_MASK = 0xFFFFFFFF
+
+def pack(lon, lat):
+    return (int(round((lon + 180) * _COORD_SCALE)) << 32) | int(round((lat + 90) * _COORD_SCALE))
+
+def unpack(key):
+    return (key >> 32) / _COORD_SCALE - 180, (key & _LOW_MASK) / _COORD_SCALE - 90
+
+def pack_array(coords):
+    # Vectorized pack over an (N, 2) array of (lon, lat)
+    lon_q = np.rint((coords[:, 0] + 180) * _COORD_SCALE).astype(np.int64)
+    lat_q = np.rint((coords[:, 1] + 90) * _COORD_SCALE).astype(np.int64)
+    return (lon_q << 32) | lat_q
+
+def unpack_array(keys):
+    keys = np.asarray(keys, dtype=np.int64)
+    coords = np.column_stack(((keys >> 32) / _COORD_SCALE - 180, (keys & _LOW_MASK) / _COORD_SCALE - 90))
+    return np.round(coords, 6)
 
 class DataLoader:
+    # Bump when the cached graph layout or edge weight semantics change
+    _GRAPH_CACHE_VERSION = 4
+    # Attributes produced by build_graph that are persisted in the graph cache
+    _GRAPH_CACHE_ATTRS = ("graph", "_node_list", "_nodes_rad", "_btree", "_node_to_idx")
+    # Flat arrays saved as .npy next to the pickle and memory-mapped read-only
+    # on load, so every worker process shares the same physical pages
+    _GRAPH_CACHE_ARRAYS = ("nodes", "csr_indptr", "csr_indices", "csr_data")
+    # Precomputed shortest-path trees, one row per infra source, mapped the
+    # same way; the infra id of each row is kept in a small JSON file
+    _SP_CACHE_ARRAYS = ("sp_sources", "sp_predecessors", "sp_distances")
+
     def __init__(self):
         self.gp_boundary = None
-        self.roads = None
         self.infra_nodes = None
+        self.infra_by_id = {}
         
         self.gp_gdf = None
         self.roads_gdf = None
         self.graph = None
+        self._node_list = []
+        self._node_arr = None
+        self._nodes_rad = None
+        self._btree = None
+        self._node_to_idx = {}
+        self._csr = None
+        self.sp_trees = {}
 
-    def load_data(self):
+    @staticmethod
+    def _cache_paths():
         base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        data_dir = os.path.join(base_dir, "data")
+        return os.path.join(base_dir, "data"), os.path.join(base_dir, "cache")
+
+    def load_data(self):
+        data_dir, cache_dir = self._cache_paths()
         
         # Load gp_boundary
         gp_path = os.path.join(data_dir, "gp_boundary.geojson")
@@ -41,44 +81,181 @@ class DataLoader:
         except Exception:
             self.gp_boundary = {"type": "FeatureCollection", "features": []}
 
-        # Load roads
+        # Clipped roads and the prebuilt graph are reused from the cache
+        # as long as it is newer than the source files.
         roads_path = os.path.join(data_dir, "roads.geojson")
-        try:
-            with open(roads_path, "r") as f:
-                self.roads_raw = json.load(f) # keeping raw if needed
-            roads_gdf = gpd.read_file(roads_path)
-            if roads_gdf.crs is None or roads_gdf.crs.to_epsg() != 4326:
-                roads_gdf = roads_gdf.to_crs(epsg=4326)
-            
-            # Clip roads to GP boundary
-            if self.gp_gdf is not None and not self.gp_gdf.empty:
-                gp_polygon = self.gp_gdf.geometry.iloc[0]
-                self.roads_gdf = gpd.clip(roads_gdf, gp_polygon)
-            else:
-                self.roads_gdf = roads_gdf
+        roads_cache = os.path.join(cache_dir, "roads_clipped.parquet")
+        graph_cache = os.path.join(cache_dir, "graph.pkl")
+        array_cache = {name: os.path.join(cache_dir, f"{name}.npy") for name in self._GRAPH_CACHE_ARRAYS}
+        from_cache = self._cache_is_fresh([gp_path, roads_path], [roads_cache, graph_cache, *array_cache.values()]) \
+            and self._load_cache(roads_cache, graph_cache, array_cache)
+
+        # Load roads
+        if not from_cache:
+            try:
+                roads_gdf = gpd.read_file(roads_path)
+                if roads_gdf.crs is None or roads_gdf.crs.to_epsg() != 4326:
+                    roads_gdf = roads_gdf.to_crs(epsg=4326)
                 
-            # Update roads geojson to clipped version
-            self.roads = json.loads(self.roads_gdf.to_json())
-            
-        except Exception:
-            self.roads = {"type": "FeatureCollection", "features": []}
+                # Clip roads to GP boundary: prune candidates through the spatial
+                # index first, then intersect only those with the boundary
+                if self.gp_gdf is not None and not self.gp_gdf.empty:
+                    gp_polygon = self.gp_gdf.geometry.iloc[0]
+                    mask_gdf = gpd.GeoDataFrame(geometry=[gp_polygon], crs=roads_gdf.crs)
+                    candidates_idx = roads_gdf.sindex.query(gp_polygon, predicate='intersects')
+                    candidates = roads_gdf.iloc[candidates_idx]
+                    self.roads_gdf = gpd.overlay(candidates, mask_gdf, how='intersection', keep_geom_type=True)
+                else:
+                    self.roads_gdf = roads_gdf
+            except Exception as e:
+                print(f"Could not load roads: {e}")
+                self.roads_gdf = None
 
         # Load infra_nodes
+        infra_path = os.path.join(data_dir, "infra_nodes.json")
         try:
-            with open(os.path.join(data_dir, "infra_nodes.json"), "r") as f:
+            with open(infra_path, "r") as f:
                 self.infra_nodes = json.load(f)
         except (FileNotFoundError, json.JSONDecodeError):
             self.infra_nodes = []
+        self.infra_by_id = {i.get("id"): i for i in self.infra_nodes}
             
-        self.build_graph()
+        if not from_cache:
+            self.build_graph()
+            self._write_cache(cache_dir, roads_cache, graph_cache, array_cache)
+
+        # The trees depend on the graph arrays and the infra nodes, so they are
+        # only reused while newer than both
+        sp_cache = {name: os.path.join(cache_dir, f"{name}.npy") for name in self._SP_CACHE_ARRAYS}
+        sp_ids = os.path.join(cache_dir, "sp_infra_ids.json")
+        sp_fresh = self._cache_is_fresh([infra_path, *array_cache.values()], [*sp_cache.values(), sp_ids])
+        if not (sp_fresh and self._load_sp_cache(sp_cache, sp_ids)):
+            self.build_sp_trees()
+            self._write_sp_cache(sp_cache, sp_ids)
+
+    def load_route_arrays(self):
+        # Route workers only walk predecessor trees or run Dijkstra on the CSR,
+        # so they map just those arrays from the cache the parent process wrote
+        # instead of unpickling the graph and rebuilding the trees.
+        _, cache_dir = self._cache_paths()
+        try:
+            arrays = {name: np.load(os.path.join(cache_dir, f"{name}.npy"), mmap_mode="r") for name in self._GRAPH_CACHE_ARRAYS}
+        except Exception as e:
+            print(f"Route arrays not cached: {e}")
+            return False
+        n = len(arrays["csr_indptr"]) - 1
+        self._csr = sp.csr_matrix(
+            (arrays["csr_data"], arrays["csr_indices"], arrays["csr_indptr"]), shape=(n, n), copy=False
+        )
+        sp_cache = {name: os.path.join(cache_dir, f"{name}.npy") for name in self._SP_CACHE_ARRAYS}
+        return self._load_sp_cache(sp_cache, os.path.join(cache_dir, "sp_infra_ids.json"))
+
+    def _load_sp_cache(self, sp_cache, sp_ids):
+        try:
+            with open(sp_ids, "r") as f:
+                infra_ids = json.load(f)
+            arrays = {name: np.load(path, mmap_mode="r") for name, path in sp_cache.items()}
+        except Exception as e:
+            print(f"Ignoring unreadable shortest-path cache: {e}")
+            return False
+        # Rows are views into the mapped files, shared by every process
+        self.sp_trees = {
+            infra_id: (int(arrays["sp_sources"][row]), arrays["sp_predecessors"][row], arrays["sp_distances"][row])
+            for row, infra_id in enumerate(infra_ids)
+        }
+        return True
+
+    def _write_sp_cache(self, sp_cache, sp_ids):
+        if self._csr is None:
+            return
+        n = self._csr.shape[0]
+        trees = list(self.sp_trees.values())
+        arrays = {
+            "sp_sources": np.array([t[0] for t in trees], dtype=np.int64),
+            "sp_predecessors": np.array([t[1] for t in trees], dtype=np.int32).reshape(len(trees), n),
+            "sp_distances": np.array([t[2] for t in trees], dtype=np.float64).reshape(len(trees), n),
+        }
+        try:
+            os.makedirs(os.path.dirname(sp_ids), exist_ok=True)
+            for name, path in sp_cache.items():
+                np.save(path, arrays[name])
+            # Written last, so a complete id list implies complete arrays
+            with open(sp_ids, "w") as f:
+                json.dump(list(self.sp_trees), f)
+        except Exception as e:
+            print(f"Could not write shortest-path cache: {e}")
+
+    def _cache_is_fresh(self, source_paths, cache_paths):
+        if not all(os.path.exists(p) for p in cache_paths):
+            return False
+        source_mtime = max((os.path.getmtime(p) for p in source_paths if os.path.exists(p)), default=0)
+        return min(os.path.getmtime(p) for p in cache_paths) > source_mtime
+
+    def _load_cache(self, roads_cache, graph_cache, array_cache):
+        try:
+            roads_gdf = gpd.read_parquet(roads_cache)
+            with open(graph_cache, "rb") as f:
+                cache = pickle.load(f)
+            if cache.get("version") != self._GRAPH_CACHE_VERSION:
+                print("Ignoring graph cache built by an older version")
+                return False
+            graph_state = {attr: cache[attr] for attr in self._GRAPH_CACHE_ATTRS}
+            arrays = {name: np.load(path, mmap_mode="r") for name, path in array_cache.items()}
+        except Exception as e:
+            print(f"Ignoring unreadable graph cache: {e}")
+            return False
+
+        self.roads_gdf = roads_gdf
+        for attr, value in graph_state.items():
+            setattr(self, attr, value)
+        n = len(self._node_list)
+        self._node_arr = arrays["nodes"]
+        # Dtypes match what csgraph expects, so dijkstra runs on the mapped
+        # buffers without copying them into the process heap
+        self._csr = sp.csr_matrix(
+            (arrays["csr_data"], arrays["csr_indices"], arrays["csr_indptr"]), shape=(n, n), copy=False
+        )
+        print(f"Loaded road graph from cache. Nodes: {self.graph.number_of_nodes()}")
+        return True
+
+    def _write_cache(self, cache_dir, roads_cache, graph_cache, array_cache):
+        if self.roads_gdf is None or self._csr is None:
+            return
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            self.roads_gdf.to_parquet(roads_cache)
+            with open(graph_cache, "wb") as f:
+                pickle.dump(
+                    {"version": self._GRAPH_CACHE_VERSION, **{attr: getattr(self, attr) for attr in self._GRAPH_CACHE_ATTRS}},
+                    f,
+                    protocol=pickle.HIGHEST_PROTOCOL,
+                )
+            arrays = {
+                "nodes": np.asarray(self._node_arr, dtype=np.float64),
+                "csr_indptr": self._csr.indptr.astype(np.int32),
+                "csr_indices": self._csr.indices.astype(np.int32),
+                "csr_data": self._csr.data.astype(np.float64),
+            }
+            for name, path in array_cache.items():
+                np.save(path, arrays[name])
+        except Exception as e:
+            print(f"Could not write graph cache: {e}")
 
     def build_graph(self):
         self.graph = nx.Graph()
+        self._node_list = []
+        self._node_arr = None
+        self._nodes_rad = None
+        self._btree = None
+        self._node_to_idx = {}
+        self._csr = None
         if self.roads_gdf is None or self.roads_gdf.empty:
             return
             
-        for _, row in self.roads_gdf.iterrows():
-            geom = row.geometry
+        edges = []
+        for geom in self.roads_gdf.geometry:
+            if geom is None:
+                continue
             if geom.geom_type == 'LineString':
                 lines = [geom]
             elif geom.geom_type == 'MultiLineString':
@@ -87,18 +264,15 @@ class DataLoader:
                 continue
                 
             for line in lines:
-                coords = list(line.coords)
-                for i in range(len(coords) - 1):
-                    u = (round(coords[i][0], 6), round(coords[i][1], 6))
-                    v = (round(coords[i+1][0], 6), round(coords[i+1][1], 6))
-                    # Edge weight = segment length. We use geographic distance.
-                    # For simplicity, calculating euclidean distance on lat/lon or simple length.
-                    # For real apps we should project to metric system like EPSG:3857, calculate length, then revert.
-                    
-                    segment = LineString([u, v])
-                    # simple length proxy for weight
-                    weight = segment.length 
-                    self.graph.add_edge(u, v, weight=weight)
+                if line.is_empty:
+                    continue
+                coords = np.round(np.asarray(line.coords)[:, :2], 6)
+                # Edge weight = segment length in meters (haversine), computed per line
+                lengths = segment_lengths_nb(coords)
+                nodes = pack_array(coords).tolist()
+                edges.extend(zip(nodes[:-1], nodes[1:], lengths.tolist()))
+
+        self.graph.add_weighted_edges_from(edges)
                     
         if len(self.graph.nodes) > 0:
             components = list(nx.connected_components(self.graph))
@@ -107,25 +281,127 @@ class DataLoader:
                 largest_cc = max(components, key=len)
                 self.graph = self.graph.subgraph(largest_cc).copy()
                 print(f"Using largest connected component. Nodes: {self.graph.number_of_nodes()}")
+
+            # Spatial index over node coordinates so snapping is O(log N).
+            # BallTree expects (lat, lon) in radians and returns great-circle distances.
+            self._node_list = list(self.graph.nodes)
+            self._node_arr = unpack_array(self._node_list)
+            self._nodes_rad = np.radians(self._node_arr[:, ::-1])
+            self._btree = BallTree(self._nodes_rad, metric='haversine')
+
+            # Flatten the graph into a symmetric CSR matrix for scipy's C Dijkstra
+            self._node_to_idx = {node: i for i, node in enumerate(self._node_list)}
+            rows = []
+            cols = []
+            data = []
+            for u, v, w in self.graph.edges(data='weight'):
+                rows.append(self._node_to_idx[u])
+                cols.append(self._node_to_idx[v])
+                data.append(w)
+            n = len(self._node_list)
+            self._csr = sp.csr_matrix((data, (rows, cols)), shape=(n, n))
+            self._csr = self._csr + self._csr.T
                     
+    def snap_many(self, lon_lat):
+        # Snap an (N, 2) array of lon/lat points with a single BallTree query.
+        # Returns (mask, idx): mask marks points within the 1 km threshold and
+        # idx holds the nearest graph node index for every point.
+        lon_lat = np.asarray(lon_lat, dtype=np.float64).reshape(-1, 2)
+        if self._btree is None or len(lon_lat) == 0:
+            return np.zeros(len(lon_lat), dtype=bool), np.full(len(lon_lat), -1, dtype=np.int64)
+
+        dists, idx = self._btree.query(np.radians(lon_lat[:, ::-1]), k=1)
+        dists = dists.ravel() * EARTH_RADIUS_M
+        mask = dists <= 1000 # 1 km threshold
+        return mask, idx.ravel()
+
+    def node_key(self, idx):
+        return self._node_list[idx]
+
     def snap_to_graph(self, lon, lat):
-        if not self.graph or len(self.graph.nodes) == 0:
+        mask, idx = self.snap_many([[lon, lat]])
+        if not mask[0]:
+            if self._btree is not None:
+                print(f"Point ({lon}, {lat}) too far from road network")
             return None
-            
-        nearest_node = None
-        min_dist = float('inf')
-        
-        for node in self.graph.nodes:
-            n_lon, n_lat = node
-            dist = haversine(lon, lat, n_lon, n_lat)
-            if dist < min_dist:
-                min_dist = dist
-                nearest_node = node
-                
-        if min_dist > 1000: # 1 km threshold
-            print(f"Point ({lon}, {lat}) too far from road network: {min_dist}m")
-            return None
-            
-        return nearest_node
+        return self.node_key(idx[0])
+
+    def build_sp_trees(self):
+        # Precompute a Dijkstra predecessor tree from every infra node so a
+        # route request only has to walk back through the predecessors.
+        self.sp_trees = {}
+        if self._csr is None:
+            return
+
+        infra_ids, coords = [], []
+        for infra in self.infra_nodes:
+            infra_id = infra.get("id")
+            lon = infra.get("longitude", infra.get("lng"))
+            lat = infra.get("latitude", infra.get("lat"))
+            if infra_id is None or lon is None or lat is None:
+                continue
+            infra_ids.append(infra_id)
+            coords.append((lon, lat))
+
+        # All infra nodes are snapped in one query instead of one per node
+        mask, idx = self.snap_many(coords)
+        sources = {infra_id: int(i) for infra_id, ok, i in zip(infra_ids, mask, idx) if ok}
+
+        if sources:
+            # One C-level multi-source call; row i holds distances/predecessors for source i
+            src_indices = list(sources.values())
+            distances, predecessors = dijkstra(self._csr, indices=src_indices, return_predecessors=True)
+            for row, (infra_id, src_idx) in enumerate(sources.items()):
+                self.sp_trees[infra_id] = (src_idx, predecessors[row], distances[row])
+        print(f"Precomputed shortest-path trees for {len(self.sp_trees)} infra nodes")
+
+    def shortest_path(self, infra_id, src_idx, dst_idx):
+        # Returns (path as graph node indices, distance in meters). Works on
+        # node indices so route workers need neither the graph nor the key map.
+        tree = self.sp_trees.get(infra_id)
+        if tree is None or tree[0] != src_idx:
+            if self.graph is not None:
+                # Unseen source: goal-directed A* instead of a full Dijkstra sweep
+                path, dist = self._astar_path(self._node_list[src_idx], self._node_list[dst_idx])
+                return [self._node_to_idx[node] for node in path], dist
+            # Route workers hold only the CSR: single-source C Dijkstra
+            dist, pred = dijkstra(self._csr, indices=src_idx, return_predecessors=True)
+            tree = (src_idx, pred, dist)
+
+        # scipy marks the source and unreachable vertices with -9999
+        _, pred, dist = tree
+        if dst_idx != src_idx and pred[dst_idx] < 0:
+            raise NoPathError(f"Node {dst_idx} not reachable from {src_idx}")
+
+        path = [dst_idx]
+        while path[-1] != src_idx:
+            path.append(int(pred[path[-1]]))
+        path.reverse()
+        return path, float(dist[dst_idx])
+
+    def route_latlng(self, path):
+        # [[lat, lng], ...] for the response, read from the parallel coordinate array
+        return self._node_arr[path][:, ::-1].tolist()
+
+    def _astar_path(self, start_node, end_node):
+        # Great-circle distance never exceeds the metric path length, so it
+        # is an admissible heuristic for the haversine edge weights.
+        def heuristic(u, v):
+            u_lon, u_lat = unpack(u)
+            v_lon, v_lat = unpack(v)
+            return haversine_nb(u_lon, u_lat, v_lon, v_lat)
+
+        try:
+            path = nx.astar_path(self.graph, start_node, end_node, heuristic=heuristic, weight='weight')
+        except nx.NetworkXNoPath:
+            raise NoPathError(f"Node {end_node} not reachable from {start_node}")
+        total_dist = sum(self.graph[path[i]][path[i + 1]]['weight'] for i in range(len(path) - 1))
+        return path, total_dist
 
 data_store = DataLoader()
+
+
+if __name__ == "__main__":
+    # Prestart step: build the cache once before the API and its route
+    # workers start, so each of them only memory-maps the arrays.
+    DataLoader().load_data()
@@ -0,0 +1,29 @@
+import numpy as np
+from numba import njit
+
+EARTH_RADIUS_M = 6371000.0  # radius of Earth in meters
+
+@njit(fastmath=True, cache=True)
+def haversine_nb(lon1, lat1, lon2, lat2):
+    # Distance between two points in meters using the Haversine formula
+    phi1 = np.radians(lat1)
+    phi2 = np.radians(lat2)
+    delta_phi = np.radians(lat2 - lat1)
+    delta_lambda = np.radians(lon2 - lon1)
+    a = np.sin(delta_phi / 2.0) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(delta_lambda / 2.0) ** 2
+    c = 2.0 * np.arctan2(np.sqrt(a), np.sqrt(1.0 - a))
+    return EARTH_RADIUS_M * c
+
+@njit(fastmath=True, cache=True)
+def segment_lengths_nb(lonlat):
+    # Length in meters of each segment of a polyline given as an (N, 2) array of (lon, lat)
+    n = lonlat.shape[0] - 1
+    out = np.empty(max(n, 0), dtype=np.float64)
+    for i in range(n):
+        out[i] = haversine_nb(lonlat[i, 0], lonlat[i, 1], lonlat[i + 1, 0], lonlat[i + 1, 1])
+    return out
+
+def warmup():
+    # Trigger JIT compilation (or cache load) before the first request
+    haversine_nb(0.0, 0.0, 0.0, 0.0)
+    segment_lengths_nb(np.zeros((2, 2), dtype=np.float64))
@@ -0,0 +1,44 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from services.data_loader import data_store
+from services.geo_kernels import warmup as warmup_geo_kernels
+
+# Worker processes that run shortest-path searches outside the event loop / GIL.
+_route_executor = None
+
+def _init_worker():
+    # Workers only map the CSR and shortest-path tree arrays the parent wrote
+    # to the cache at startup, so those pages are shared rather than copied;
+    # a full load is the fallback when the cache could not be written.
+    warmup_geo_kernels()
+    if not data_store.load_route_arrays():
+        data_store.load_data()
+
+def _shortest_path(infra_id, src_idx, dst_idx):
+    return data_store.shortest_path(infra_id, src_idx, dst_idx)
+
+def start_route_executor():
+    global _route_executor
+    if _route_executor is None:
+        # Spawned, not forked: a fork after startup would hand every worker the
+        # parent's NetworkX graph and GeoDataFrames, which copy-on-write then
+        # duplicates page by page. Spawned workers start empty and map only
+        # the route arrays, whatever the platform's default start method.
+        _route_executor = ProcessPoolExecutor(
+            max_workers=os.cpu_count(),
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+        )
+    return _route_executor
+
+def shutdown_route_executor():
+    global _route_executor
+    if _route_executor is not None:
+        _route_executor.shutdown(wait=True, cancel_futures=True)
+        _route_executor = None
+
+async def run_shortest_path(infra_id, src_idx, dst_idx):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(start_route_executor(), _shortest_path, infra_id, int(src_idx), int(dst_idx))
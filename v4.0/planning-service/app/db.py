@@ -1,15 +1,29 @@
 from contextlib import contextmanager
 
-import psycopg
 from psycopg.rows import dict_row
+from psycopg_pool import ConnectionPool
 
 from app.config import settings
 
+# Shared connection pool; opened and closed by the application lifespan.
+pool = ConnectionPool(
+    settings.database_url,
+    min_size=settings.db_pool_min_size,
+    max_size=settings.db_pool_max_size,
+    kwargs={"row_factory": dict_row},
+    open=False,
+)
+
+
+def open_pool() -> None:
+    pool.open()
+
+
+def close_pool() -> None:
+    pool.close()
+
 
 @contextmanager
 def get_db():
-    conn = psycopg.connect(settings.database_url, row_factory=dict_row)
-    try:
+    with pool.connection() as conn:
         yield conn
-    finally:
-        conn.close()
@@ -79,7 +79,11 @@ class InMemoryRateLimitMiddleware(BaseHTTPMiddleware):
         now = time.time()
 
         with self._lock:
-            queue = self._requests_by_ip.setdefault(client_ip, deque())
+            queue = self._requests_by_ip.get(client_ip)
+            if queue is None:
+                # Admitted requests never exceed max_requests per window, so
+                # maxlen bounds both memory and the expiry loop below.
+                queue = self._requests_by_ip[client_ip] = deque(maxlen=self.max_requests)
             while queue and (now - queue[0]) > self.window_seconds:
                 queue.popleft()
 
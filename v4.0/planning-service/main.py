@@ -1,5 +1,7 @@
 import uvicorn
 import logging
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
@@ -7,6 +9,7 @@ from fastapi.requests import Request
 from fastapi.responses import JSONResponse
 
 from app.config import settings
+from app.db import close_pool, open_pool
 from app.errors import AppError
 from app.logging_setup import configure_logging
 from app.middleware import InMemoryRateLimitMiddleware, PayloadSizeLimitMiddleware, RequestContextMiddleware
@@ -17,10 +20,21 @@ from app.routers.routing import router as routing_router
 configure_logging()
 logger = logging.getLogger("planning-service")
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    open_pool()
+    try:
+        yield
+    finally:
+        close_pool()
+
+
 app = FastAPI(
     title=settings.app_name,
     description=settings.app_description,
     version=settings.app_version,
+    lifespan=lifespan,
 )
 
 origins = [origin.strip() for origin in settings.cors_allow_origins.split(",") if origin.strip()]
@@ -0,0 +1,91 @@
+import logging
+
+from app.db import close_pool, get_db, open_pool
+from app.job_repository import job_repository
+
+logger = logging.getLogger("planning-service")
+
+# Tables the service reads that databases loaded before they existed do not
+# have. franchise_zones_sub is rebuilt from franchise_zones only while it is
+# empty, so a normal loader run (which fills it itself) is never redone.
+CREATE_DATASET_VERSION_SQL = """
+CREATE TABLE IF NOT EXISTS dataset_version (
+    singleton BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (singleton),
+    version BIGINT NOT NULL DEFAULT 0,
+    loaded_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+INSERT INTO dataset_version DEFAULT VALUES ON CONFLICT DO NOTHING;
+"""
+
+CREATE_FRANCHISE_SUB_SQL = """
+CREATE TABLE IF NOT EXISTS franchise_zones_sub (
+    franchise_id TEXT NOT NULL REFERENCES franchise_zones(franchise_id) ON DELETE CASCADE,
+    geom geometry(Polygon, 4326) NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_franchise_sub_geom ON franchise_zones_sub USING GIST (geom);
+"""
+
+BACKFILL_FRANCHISE_SUB_SQL = """
+INSERT INTO franchise_zones_sub (franchise_id, geom)
+SELECT franchise_id, ST_Subdivide(geom, 256)::geometry(Polygon, 4326)
+FROM franchise_zones
+WHERE NOT EXISTS (SELECT 1 FROM franchise_zones_sub)
+"""
+
+
+def upgrade_planning_tables() -> int:
+    """Create dataset_version, and franchise_zones_sub (filled) once franchise_zones is loaded."""
+    with get_db() as conn:
+        with conn.cursor() as cur:
+            cur.execute(CREATE_DATASET_VERSION_SQL)
+            cur.execute("SELECT to_regclass('franchise_zones') IS NOT NULL AS loaded")
+            if not cur.fetchone()["loaded"]:
+                # Nothing loaded yet; the loader creates the rest.
+                conn.commit()
+                return 0
+            cur.execute(CREATE_FRANCHISE_SUB_SQL)
+            cur.execute(BACKFILL_FRANCHISE_SUB_SQL)
+            inserted = cur.rowcount
+        conn.commit()
+    if inserted:
+        logger.warning(
+            "backfilled_franchise_subdivisions",
+            extra={"franchise_sub_rows": inserted},
+        )
+    return inserted
+
+
+def prepare_job_tables() -> int:
+    """
+    Create the job tables and fail jobs left running by a previous process.
+
+    Must run once per deployment, not once per worker: with several workers a
+    per-worker recovery scan would fail jobs that a sibling is still running.
+    """
+    job_repository.ensure_schema()
+    return recover_incomplete_jobs()
+
+
+def recover_incomplete_jobs() -> int:
+    # Logged once with the total, not per page.
+    recovered = job_repository.mark_incomplete_jobs_failed()
+    if recovered:
+        logger.warning(
+            "recovered_incomplete_jobs",
+            extra={"recovered_jobs": recovered},
+        )
+    return recovered
+
+
+if __name__ == "__main__":
+    # One-shot entry point (`python -m app.bootstrap`) for the Gunicorn
+    # on_starting hook or an init container.
+    from app.logging_setup import configure_logging
+
+    configure_logging()
+    open_pool()
+    try:
+        upgrade_planning_tables()
+        prepare_job_tables()
+    finally:
+        close_pool()
@@ -3,17 +3,61 @@ from typing import Any, Sequence
 
 import psycopg
 from psycopg.rows import dict_row
+from psycopg_pool import ConnectionPool
 
 from app.config import settings
 
 
+def _configure_connection(conn: psycopg.Connection) -> None:
+    """
+    Apply session settings once per physical connection instead of per checkout.
+    """
+    # Short KNN / routing queries never benefit from JIT compilation.
+    conn.execute("SET jit = off")
+    conn.commit()
+
+
+# Every job/chunk/batch worker thread (plus the chunk-result flusher) may hold
+# a connection at once (each JobRepository call checks one out), so the pool
+# is sized for that when the connection budget allows it.
+_worker_threads = settings.executor_max_workers + settings.chunk_executor_max_workers + settings.batch_route_max_workers + 1
+
+# WEB_CONCURRENCY processes share one database, so each gets an equal share of
+# DB_MAX_CONNECTIONS; threads beyond it wait for a free connection. A batch
+# route request holds one connection while each of its chunks takes another,
+# so the share never drops below that.
+_process_budget = max(
+    settings.batch_route_max_workers + 2,
+    settings.db_max_connections // max(1, settings.web_concurrency),
+)
+_max_size = min(max(settings.db_pool_max_size, _worker_threads), _process_budget)
+
+# Shared connection pool; opened and closed from the application startup/shutdown hooks.
+pool = ConnectionPool(
+    settings.database_url,
+    min_size=min(settings.db_pool_min_size, _max_size),
+    max_size=_max_size,
+    # Statements run this many times on a connection get prepared server-side.
+    kwargs={"row_factory": dict_row, "prepare_threshold": 5},
+    configure=_configure_connection,
+    open=False,
+)
+
+
+def open_pool() -> None:
+    # Block until min_size connections are up (and configured), so the first
+    # requests after startup do not pay connect latency.
+    pool.open(wait=True, timeout=settings.db_pool_open_timeout_seconds)
+
+
+def close_pool() -> None:
+    pool.close()
+
+
 @contextmanager
 def get_db():
-    conn = psycopg.connect(settings.database_url, row_factory=dict_row)
-    try:
+    with pool.connection() as conn:
         yield conn
-    finally:
-        conn.close()
 
 
 def execute_parameterized(conn: psycopg.Connection, query: str, params: Sequence[Any] | None = None):
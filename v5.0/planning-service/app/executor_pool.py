@@ -5,8 +5,10 @@ from app.config import settings
 # Global executors created once at module load.
 JOB_EXECUTOR = ThreadPoolExecutor(max_workers=settings.executor_max_workers, thread_name_prefix="job-worker")
 CHUNK_EXECUTOR = ThreadPoolExecutor(max_workers=settings.chunk_executor_max_workers, thread_name_prefix="chunk-worker")
+BATCH_ROUTE_EXECUTOR = ThreadPoolExecutor(max_workers=settings.batch_route_max_workers, thread_name_prefix="batch-route-worker")
 
 
 def shutdown_executors() -> None:
     JOB_EXECUTOR.shutdown(wait=True, cancel_futures=True)
     CHUNK_EXECUTOR.shutdown(wait=True, cancel_futures=True)
+    BATCH_ROUTE_EXECUTOR.shutdown(wait=True, cancel_futures=True)
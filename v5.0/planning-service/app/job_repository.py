@@ -1,10 +1,28 @@
 from __future__ import annotations
 
+import logging
+import os
+import queue
+import socket
+import threading
+import time
 import uuid
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 
+from app.config import settings
 from app.db import get_db
 
+logger = logging.getLogger("planning-service")
+
+# Identifies this process in batch_workers; jobs record which worker owns them.
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+# Serializes admission across worker processes (transaction-scoped).
+ADMISSION_LOCK_KEY = "batch_job_admission"
+
+# (job_id, chunk_index, processed_points, status, error_message, duration_ms)
+ChunkResultRow = Tuple[str, int, int, str, Optional[str], int]
+
 
 CREATE_JOBS_SQL = """
 CREATE TABLE IF NOT EXISTS batch_jobs (
@@ -19,6 +37,16 @@ CREATE TABLE IF NOT EXISTS batch_jobs (
     finished_at TIMESTAMP,
     error_message TEXT
 );
+ALTER TABLE batch_jobs ADD COLUMN IF NOT EXISTS worker_id TEXT;
+"""
+
+# One row per live worker process; a job whose worker row has gone stale (or
+# is gone) belongs to a process that died and will never finish it.
+CREATE_WORKERS_SQL = """
+CREATE TABLE IF NOT EXISTS batch_workers (
+    worker_id TEXT PRIMARY KEY,
+    heartbeat_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
 """
 
 CREATE_CHUNK_RESULTS_SQL = """
@@ -36,6 +64,9 @@ CREATE TABLE IF NOT EXISTS batch_chunk_results (
 CREATE_INDEXES_SQL = """
 CREATE INDEX IF NOT EXISTS idx_batch_jobs_status ON batch_jobs(status);
 CREATE INDEX IF NOT EXISTS idx_batch_chunk_results_job_id ON batch_chunk_results(job_id);
+-- Only live jobs are indexed, so admission checks stay cheap as history grows.
+CREATE INDEX IF NOT EXISTS idx_batch_jobs_active
+ON batch_jobs(created_at) WHERE status IN ('queued', 'processing');
 """
 
 
@@ -44,23 +75,36 @@ class JobRepository:
         with get_db() as conn:
             with conn.cursor() as cur:
                 cur.execute(CREATE_JOBS_SQL)
+                cur.execute(CREATE_WORKERS_SQL)
                 cur.execute(CREATE_CHUNK_RESULTS_SQL)
                 cur.execute(CREATE_INDEXES_SQL)
             conn.commit()
 
-    def create_job(self, job_id: str, total_points: int, total_chunks: int, status: str = "queued") -> None:
+    def create_job_if_capacity(self, job_id: str, total_points: int, total_chunks: int, max_active_jobs: int) -> bool:
+        """
+        Insert a queued job owned by this worker unless ``max_active_jobs`` are
+        already live across all workers. The advisory lock makes the count and
+        the insert atomic with respect to other workers' admissions.
+        """
         with get_db() as conn:
             with conn.cursor() as cur:
+                cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (ADMISSION_LOCK_KEY,), prepare=True)
                 cur.execute(
                     """
                     INSERT INTO batch_jobs (
-                        job_id, total_points, total_chunks, processed_chunks, failed_chunks, status
+                        job_id, total_points, total_chunks, processed_chunks, failed_chunks, status, worker_id
                     )
-                    VALUES (%s::uuid, %s, %s, 0, 0, %s)
+                    SELECT %s::uuid, %s, %s, 0, 0, 'queued', %s
+                    WHERE (
+                        SELECT COUNT(*) FROM batch_jobs WHERE status IN ('queued', 'processing')
+                    ) < %s
                     """,
-                    (job_id, total_points, total_chunks, status),
+                    (job_id, total_points, total_chunks, WORKER_ID, max_active_jobs),
+                    prepare=True,
                 )
+                admitted = cur.rowcount == 1
             conn.commit()
+        return admitted
 
     def update_job_status(
         self,
@@ -86,6 +130,7 @@ class JobRepository:
                 cur.execute(
                     f"UPDATE batch_jobs SET {', '.join(set_parts)} WHERE job_id = %s::uuid",
                     tuple(params),
+                    prepare=True,
                 )
             conn.commit()
 
@@ -98,26 +143,44 @@ class JobRepository:
         error_message: Optional[str],
         duration_ms: int,
     ) -> None:
+        self.persist_chunk_results_bulk(
+            [(job_id, chunk_index, processed_points, status, error_message, duration_ms)]
+        )
+
+    def persist_chunk_results_bulk(self, rows: Sequence[ChunkResultRow]) -> None:
+        if not rows:
+            return
+        job_ids, chunk_indexes, processed_points, statuses, error_messages, durations = (list(col) for col in zip(*rows))
+        # A single statement: the INSERT's RETURNING rows feed the per-job counter UPDATE.
         with get_db() as conn:
             with conn.cursor() as cur:
                 cur.execute(
                     """
-                    INSERT INTO batch_chunk_results (
-                        job_id, chunk_index, processed_points, status, error_message, duration_ms
+                    WITH ins AS (
+                        INSERT INTO batch_chunk_results (
+                            job_id, chunk_index, processed_points, status, error_message, duration_ms
+                        )
+                        SELECT *
+                        FROM UNNEST(%s::uuid[], %s::int[], %s::int[], %s::text[], %s::text[], %s::int[])
+                        RETURNING job_id, status
+                    ),
+                    counts AS (
+                        SELECT
+                            job_id,
+                            COUNT(*)::int AS processed,
+                            (COUNT(*) FILTER (WHERE status = 'failed'))::int AS failed
+                        FROM ins
+                        GROUP BY job_id
                     )
-                    VALUES (%s::uuid, %s, %s, %s, %s, %s)
-                    """,
-                    (job_id, chunk_index, processed_points, status, error_message, duration_ms),
-                )
-                cur.execute(
-                    """
-                    UPDATE batch_jobs
+                    UPDATE batch_jobs AS j
                     SET
-                        processed_chunks = processed_chunks + 1,
-                        failed_chunks = failed_chunks + CASE WHEN %s = 'failed' THEN 1 ELSE 0 END
-                    WHERE job_id = %s::uuid
+                        processed_chunks = j.processed_chunks + c.processed,
+                        failed_chunks = j.failed_chunks + c.failed
+                    FROM counts AS c
+                    WHERE j.job_id = c.job_id
                     """,
-                    (status, job_id),
+                    (job_ids, chunk_indexes, processed_points, statuses, error_messages, durations),
+                    prepare=True,
                 )
             conn.commit()
 
@@ -141,6 +204,7 @@ class JobRepository:
                     WHERE job_id = %s::uuid
                     """,
                     (job_id,),
+                    prepare=True,
                 )
                 row = cur.fetchone()
         return row
@@ -161,6 +225,7 @@ class JobRepository:
                     ORDER BY chunk_index
                     """,
                     (job_id,),
+                    prepare=True,
                 )
                 rows = cur.fetchall()
         return rows
@@ -168,22 +233,96 @@ class JobRepository:
     def active_job_count(self) -> int:
         with get_db() as conn:
             with conn.cursor() as cur:
-                cur.execute("SELECT COUNT(*) AS c FROM batch_jobs WHERE status IN ('queued', 'processing')")
+                cur.execute(
+                    "SELECT COUNT(*) AS c FROM batch_jobs WHERE status IN ('queued', 'processing')",
+                    prepare=True,
+                )
                 row = cur.fetchone()
         return int(row["c"])
 
-    def mark_incomplete_jobs_failed(self) -> int:
+    def mark_incomplete_jobs_failed(self, page_size: int = 1000) -> int:
+        """
+        Fail jobs left queued/processing by a previous process, one page per
+        transaction so no single UPDATE holds row locks on every stale job.
+
+        Only jobs created before the scan started are touched, so it can run
+        while this process is already accepting new jobs.
+        """
+        updated = 0
+        with get_db() as conn:
+            cutoff = conn.execute("SELECT NOW() AS now").fetchone()["now"]
+            conn.commit()
+            while True:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        """
+                        UPDATE batch_jobs
+                        SET
+                            status = 'failed',
+                            finished_at = NOW(),
+                            error_message = 'Server restarted during execution.'
+                        WHERE job_id IN (
+                            SELECT job_id
+                            FROM batch_jobs
+                            WHERE status IN ('queued', 'processing')
+                              AND created_at < %s
+                            ORDER BY created_at
+                            LIMIT %s
+                            FOR UPDATE SKIP LOCKED
+                        )
+                        """,
+                        (cutoff, page_size),
+                        prepare=True,
+                    )
+                    page = cur.rowcount
+                conn.commit()
+                updated += page
+                if page < page_size:
+                    return updated
+
+    def heartbeat(self) -> None:
+        with get_db() as conn:
+            conn.execute(
+                """
+                INSERT INTO batch_workers (worker_id, heartbeat_at) VALUES (%s, NOW())
+                ON CONFLICT (worker_id) DO UPDATE SET heartbeat_at = EXCLUDED.heartbeat_at
+                """,
+                (WORKER_ID,),
+                prepare=True,
+            )
+            conn.commit()
+
+    def unregister_worker(self) -> None:
+        with get_db() as conn:
+            conn.execute("DELETE FROM batch_workers WHERE worker_id = %s", (WORKER_ID,))
+            conn.commit()
+
+    def fail_orphaned_jobs(self, stale_after_seconds: float) -> int:
+        """Fail live jobs whose owning worker stopped heartbeating, and forget that worker."""
         with get_db() as conn:
             with conn.cursor() as cur:
                 cur.execute(
                     """
-                    UPDATE batch_jobs
+                    WITH stale AS (
+                        DELETE FROM batch_workers
+                        WHERE heartbeat_at < NOW() - make_interval(secs => %s)
+                        RETURNING worker_id
+                    )
+                    UPDATE batch_jobs j
                     SET
                         status = 'failed',
                         finished_at = NOW(),
-                        error_message = 'Server restarted during execution.'
-                    WHERE status IN ('queued', 'processing')
-                    """
+                        error_message = 'Worker stopped during execution.'
+                    WHERE j.status IN ('queued', 'processing')
+                      AND j.worker_id IS NOT NULL
+                      AND j.worker_id <> %s
+                      AND (
+                          j.worker_id IN (SELECT worker_id FROM stale)
+                          OR NOT EXISTS (SELECT 1 FROM batch_workers w WHERE w.worker_id = j.worker_id)
+                      )
+                    """,
+                    (stale_after_seconds, WORKER_ID),
+                    prepare=True,
                 )
                 updated = cur.rowcount
             conn.commit()
@@ -198,35 +337,200 @@ class JobRepository:
                         COUNT(*) FILTER (WHERE status IN ('queued', 'processing'))::int AS active_jobs,
                         COUNT(*) FILTER (WHERE status = 'completed')::int AS completed_jobs,
                         COUNT(*) FILTER (WHERE status = 'failed')::int AS failed_jobs,
-                        COUNT(*)::int AS total_jobs
-                    FROM batch_jobs
-                    """
-                )
-                row = cur.fetchone()
-                cur.execute(
-                    """
-                    SELECT COALESCE(AVG(duration_ms), 0)::float8 AS average_chunk_duration_ms
-                    FROM batch_chunk_results
-                    """
-                )
-                row_chunk = cur.fetchone()
-                cur.execute(
-                    """
-                    SELECT
+                        COUNT(*)::int AS total_jobs,
                         COALESCE(
-                            AVG(EXTRACT(EPOCH FROM (finished_at - started_at)) * 1000),
+                            AVG(EXTRACT(EPOCH FROM (finished_at - started_at)) * 1000)
+                                FILTER (WHERE started_at IS NOT NULL AND finished_at IS NOT NULL),
                             0
-                        )::float8 AS average_job_duration_ms
+                        )::float8 AS average_job_duration_ms,
+                        (
+                            SELECT COALESCE(AVG(duration_ms), 0)::float8
+                            FROM batch_chunk_results
+                        ) AS average_chunk_duration_ms
                     FROM batch_jobs
-                    WHERE started_at IS NOT NULL AND finished_at IS NOT NULL
-                    """
+                    """,
+                    prepare=True,
                 )
-                row2 = cur.fetchone()
+                row = cur.fetchone()
         return {
             **row,
-            "average_chunk_duration_ms": float(row_chunk["average_chunk_duration_ms"]),
-            "average_job_duration_ms": float(row2["average_job_duration_ms"]),
+            "average_chunk_duration_ms": float(row["average_chunk_duration_ms"]),
+            "average_job_duration_ms": float(row["average_job_duration_ms"]),
         }
 
+# Queue marker asking the flusher to write what it holds right away.
+_FLUSH_NOW = object()
+
+# Waits between attempts at writing a batch before its rows are given up on.
+_FLUSH_RETRY_DELAYS_SECONDS = (0.5, 1.0, 2.0, 4.0)
+
+
+class ChunkResultWriter:
+    """Buffers chunk results and persists them from a single flusher thread.
+
+    Workers call ``submit``; the flusher writes whatever has accumulated once
+    ``batch_size`` rows are queued or ``flush_interval`` seconds have passed.
+    Unwritten rows are counted per job so ``flush`` waits only for the
+    caller's own rows, not for every job sharing the queue. A batch that still
+    fails after its retries marks each of its jobs as failed, and ``flush``
+    reports that to the caller.
+    """
+
+    def __init__(self, repository: JobRepository, batch_size: int, flush_interval: float) -> None:
+        self._repository = repository
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._queue: queue.Queue[Any] = queue.Queue(maxsize=batch_size * 4)
+        self._thread: Optional[threading.Thread] = None
+        self._pending: Dict[str, int] = {}
+        self._pending_changed = threading.Condition()
+        self._failed_jobs: set[str] = set()
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="chunk-result-flusher", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+    def submit(
+        self,
+        job_id: str,
+        chunk_index: int,
+        processed_points: int,
+        status: str,
+        error_message: Optional[str],
+        duration_ms: int,
+    ) -> None:
+        with self._pending_changed:
+            self._pending[job_id] = self._pending.get(job_id, 0) + 1
+        self._queue.put((job_id, chunk_index, processed_points, status, error_message, duration_ms))
+
+    def flush(self, job_id: str) -> bool:
+        """Block until every row submitted for ``job_id`` is handled; False if any were lost."""
+        with self._pending_changed:
+            needs_wait = bool(self._pending.get(job_id))
+        if needs_wait:
+            # Cut the flusher's batching wait short instead of sitting out the interval.
+            self._queue.put(_FLUSH_NOW)
+        with self._pending_changed:
+            self._pending_changed.wait_for(lambda: not self._pending.get(job_id))
+            if job_id in self._failed_jobs:
+                self._failed_jobs.discard(job_id)
+                return False
+        return True
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            first = self._queue.get()
+            if first is None:
+                break
+            if first is _FLUSH_NOW:
+                continue
+            batch = [first]
+            deadline = time.monotonic() + self._flush_interval
+            while len(batch) < self._batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                if item is _FLUSH_NOW:
+                    break
+                batch.append(item)
+            self._mark_written(batch, self._persist_with_retry(batch))
+
+    def _persist_with_retry(self, batch: Sequence[ChunkResultRow]) -> bool:
+        for delay in (*_FLUSH_RETRY_DELAYS_SECONDS, None):
+            try:
+                self._repository.persist_chunk_results_bulk(batch)
+                return True
+            except Exception:
+                if delay is None:
+                    logger.exception("chunk_result_flush_failed", extra={"rows": len(batch)})
+                    return False
+                logger.warning("chunk_result_flush_retry", extra={"rows": len(batch)}, exc_info=True)
+                time.sleep(delay)
+        return False
+
+    def _mark_written(self, batch: Sequence[ChunkResultRow], persisted: bool) -> None:
+        with self._pending_changed:
+            if not persisted:
+                self._failed_jobs.update(row[0] for row in batch)
+            for row in batch:
+                job_id = row[0]
+                left = self._pending[job_id] - 1
+                if left:
+                    self._pending[job_id] = left
+                else:
+                    del self._pending[job_id]
+            self._pending_changed.notify_all()
+
+
+class WorkerHeartbeat:
+    """Keeps this worker's batch_workers row fresh and fails other workers' orphaned jobs."""
+
+    def __init__(self, repository: JobRepository, interval: float, stale_after: float) -> None:
+        self._repository = repository
+        self._interval = interval
+        self._stale_after = stale_after
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        # Registered before any job is admitted, so this worker's own jobs are
+        # never mistaken for orphans.
+        self._repository.heartbeat()
+        self._thread = threading.Thread(target=self._run, name="worker-heartbeat", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        # Jobs still queued here are picked up as orphans by the other workers.
+        try:
+            self._repository.unregister_worker()
+        except Exception:
+            logger.exception("worker_unregister_failed")
+
+    def _run(self) -> None:
+        while not self._stop.wait(self._interval):
+            try:
+                self._repository.heartbeat()
+                orphaned = self._repository.fail_orphaned_jobs(self._stale_after)
+            except Exception:
+                logger.exception("worker_heartbeat_failed")
+                continue
+            if orphaned:
+                logger.warning("recovered_orphaned_jobs", extra={"recovered_jobs": orphaned})
+
 
 job_repository = JobRepository()
+worker_heartbeat = WorkerHeartbeat(
+    job_repository,
+    interval=settings.worker_heartbeat_interval_seconds,
+    stale_after=settings.worker_heartbeat_timeout_seconds,
+)
+chunk_result_writer = ChunkResultWriter(
+    job_repository,
+    batch_size=settings.chunk_result_flush_batch_size,
+    flush_interval=settings.chunk_result_flush_interval_seconds,
+)
@@ -1,19 +1,112 @@
+import array
+import heapq
 import json
 import logging
 import threading
 import time
 import uuid
-from typing import Any, Dict, Optional
+from types import MappingProxyType
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, Optional, Tuple
 
 from app.config import settings
 
 logger = logging.getLogger("planning-service")
 
+_RESULT_KEYS = ("chunk_index", "processed_points", "status", "error_message", "duration_ms")
+# Three 8-byte array slots plus three list pointers per stored chunk result.
+_RESULT_ROW_BYTES = 3 * 8 + 3 * 8
+_CHUNK_SIZE_ENTRY_BYTES = 6
+_TERMINAL_STATUSES = frozenset({"completed", "failed"})
+# Janitor passes evict at most this many jobs per lock acquisition so chunk
+# workers appending results are never stuck behind a long cleanup.
+_EVICTION_BATCH = 128
+
+
+class ChunkResults:
+    """Chunk results stored column-wise instead of as one dict per chunk.
+
+    Iterating or indexing rebuilds the result dicts on demand. Keys a chunk
+    processor adds beyond the standard ones are kept per row in ``_extra``.
+    """
+
+    def __init__(self, items: Iterable[Dict[str, Any]] = ()) -> None:
+        self._chunk_index = array.array("q")
+        self._processed_points = array.array("q")
+        self._duration_ms = array.array("q")
+        self._status: List[str] = []
+        self._error_message: List[Optional[str]] = []
+        self._extra: List[Optional[Dict[str, Any]]] = []
+        self._size_bytes = 0
+        for item in items:
+            self.append(item)
+
+    def append(self, item: Dict[str, Any]) -> int:
+        """Store one result and return its approximate size in bytes."""
+        error_message = item.get("error_message")
+        extra = {key: value for key, value in item.items() if key not in _RESULT_KEYS} or None
+        self._chunk_index.append(int(item.get("chunk_index") or 0))
+        self._processed_points.append(int(item.get("processed_points") or 0))
+        self._duration_ms.append(int(item.get("duration_ms") or 0))
+        self._status.append(item.get("status"))
+        self._error_message.append(error_message)
+        self._extra.append(extra)
+
+        size = _RESULT_ROW_BYTES + (len(error_message) if isinstance(error_message, str) else 0)
+        if extra is not None:
+            size += len(json.dumps(extra, default=str).encode("utf-8"))
+        self._size_bytes += size
+        return size
+
+    @property
+    def size_bytes(self) -> int:
+        return self._size_bytes
+
+    def __len__(self) -> int:
+        return len(self._status)
+
+    def __getitem__(self, index: int) -> Dict[str, Any]:
+        row = {
+            "chunk_index": self._chunk_index[index],
+            "processed_points": self._processed_points[index],
+            "status": self._status[index],
+            "error_message": self._error_message[index],
+            "duration_ms": self._duration_ms[index],
+        }
+        extra = self._extra[index]
+        if extra:
+            row.update(extra)
+        return row
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for index in range(len(self)):
+            yield self[index]
+
 
 class InMemoryJobStore:
+    """Process-local cache of batch job records.
+
+    Accessors return read-only live views of the stored records rather than
+    copies; all mutation goes through ``update_job``/``append_result``.
+    """
+
     def __init__(self):
         self._jobs: Dict[str, Dict[str, Any]] = {}
         self._lock = threading.Lock()
+        # Approximate footprint per job and in total, kept current on every
+        # mutation so the memory guard never has to re-measure the whole store.
+        self._job_sizes: Dict[str, int] = {}
+        self._total_bytes = 0
+        # (finished_at, job_id) for every job that reached a terminal status; entries
+        # for jobs since removed or replaced are skipped lazily when popped.
+        self._evict_heap: list[tuple[float, str]] = []
+        # monotonic time a record was hydrated from the database; jobs this
+        # process runs itself are always current and have no entry.
+        self._fetched_at: Dict[str, float] = {}
+        self._janitor: Optional[threading.Thread] = None
+        self._janitor_stop = threading.Event()
+        # Serializes whole cleanup passes (janitor vs. an explicit call during shutdown).
+        self._cleanup_lock = threading.Lock()
+        self._job_header_bytes = self._json_size_bytes(self._new_job_record(total_points=0, chunk_sizes=[]))
 
     def _new_job_record(self, total_points: int, chunk_sizes: list[int]) -> Dict[str, Any]:
         job_id = str(uuid.uuid4())
@@ -26,7 +119,7 @@ class InMemoryJobStore:
             "chunk_sizes": chunk_sizes,
             "processed_chunks": 0,
             "failed_chunks": 0,
-            "results": [],
+            "results": ChunkResults(),
             "error_message": None,
             "created_at": now,
             "started_at": None,
@@ -37,50 +130,73 @@ class InMemoryJobStore:
             "total_processing_time": 0,
         }
 
-    def create_job(self, total_points: int, chunk_sizes: list[int]) -> Dict[str, Any]:
+    def create_job(self, total_points: int, chunk_sizes: list[int]) -> Mapping[str, Any]:
         record = self._new_job_record(total_points=total_points, chunk_sizes=chunk_sizes)
         with self._lock:
-            self._jobs[record["job_id"]] = record
-            self._enforce_memory_limit_locked()
-        return dict(record)
+            self._store_locked(record)
+            evicted = self._enforce_memory_limit_locked()
+        self._log_eviction(evicted)
+        return MappingProxyType(record)
 
-    def create_job_if_capacity(self, total_points: int, chunk_sizes: list[int], max_active_jobs: int) -> Optional[Dict[str, Any]]:
+    def create_job_if_capacity(self, total_points: int, chunk_sizes: list[int], max_active_jobs: int) -> Optional[Mapping[str, Any]]:
         record = self._new_job_record(total_points=total_points, chunk_sizes=chunk_sizes)
         with self._lock:
             active = sum(1 for job in self._jobs.values() if job["status"] in {"queued", "processing"})
             if active >= max_active_jobs:
                 return None
-            self._jobs[record["job_id"]] = record
-            self._enforce_memory_limit_locked()
-        return dict(record)
+            self._store_locked(record)
+            evicted = self._enforce_memory_limit_locked()
+        self._log_eviction(evicted)
+        return MappingProxyType(record)
 
-    def set_job(self, record: Dict[str, Any]) -> Dict[str, Any]:
+    def set_job(self, record: Dict[str, Any]) -> Mapping[str, Any]:
         with self._lock:
-            self._jobs[record["job_id"]] = dict(record)
-            self._enforce_memory_limit_locked()
-            return dict(self._jobs[record["job_id"]])
+            self._store_locked({**record, "results": ChunkResults(record.get("results") or ())})
+            self._fetched_at[record["job_id"]] = time.monotonic()
+            evicted = self._enforce_memory_limit_locked()
+            stored = self._jobs.get(record["job_id"])
+            view = MappingProxyType(stored if stored else dict(record))
+        self._log_eviction(evicted)
+        return view
 
-    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+    def get_job(self, job_id: str) -> Optional[Mapping[str, Any]]:
         with self._lock:
             job = self._jobs.get(job_id)
-            return dict(job) if job else None
+            return MappingProxyType(job) if job else None
 
-    def update_job(self, job_id: str, **kwargs) -> Optional[Dict[str, Any]]:
+    def get_job_with_ts(self, job_id: str) -> Tuple[Optional[Mapping[str, Any]], Optional[float]]:
+        """Return the job and, for records hydrated from the database, when they were fetched."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if not job:
+                return None, None
+            return MappingProxyType(job), self._fetched_at.get(job_id)
+
+    def update_job(self, job_id: str, **kwargs) -> Optional[Mapping[str, Any]]:
         with self._lock:
             job = self._jobs.get(job_id)
             if not job:
                 return None
+            self._adjust_size_locked(
+                job_id,
+                sum(self._estimate_field_bytes(value) - self._estimate_field_bytes(job.get(key)) for key, value in kwargs.items()),
+            )
+            previous_key = self._eviction_key(job) if job["status"] in _TERMINAL_STATUSES else None
             job.update(kwargs)
             job["last_updated_at"] = time.time()
-            self._enforce_memory_limit_locked()
-            return dict(job)
+            if previous_key is None or self._eviction_key(job) != previous_key:
+                self._push_if_terminal_locked(job)
+            evicted = self._enforce_memory_limit_locked()
+            view = MappingProxyType(job)
+        self._log_eviction(evicted)
+        return view
 
-    def append_result(self, job_id: str, item: Dict[str, Any], failed: bool = False) -> Optional[Dict[str, Any]]:
+    def append_result(self, job_id: str, item: Dict[str, Any], failed: bool = False) -> Optional[Mapping[str, Any]]:
         with self._lock:
             job = self._jobs.get(job_id)
             if not job:
                 return None
-            job["results"].append(item)
+            self._adjust_size_locked(job_id, job["results"].append(item))
             job["processed_chunks"] += 1
             if failed:
                 job["failed_chunks"] += 1
@@ -93,12 +209,14 @@ class InMemoryJobStore:
             job["total_processing_time"] = int(job.get("total_processing_time") or 0) + duration
 
             job["last_updated_at"] = time.time()
-            self._enforce_memory_limit_locked()
-            return dict(job)
+            evicted = self._enforce_memory_limit_locked()
+            view = MappingProxyType(job)
+        self._log_eviction(evicted)
+        return view
 
     def pop_job(self, job_id: str) -> Optional[Dict[str, Any]]:
         with self._lock:
-            return self._jobs.pop(job_id, None)
+            return self._discard_locked(job_id)
 
     def active_job_count(self) -> int:
         with self._lock:
@@ -118,60 +236,136 @@ class InMemoryJobStore:
             }
 
     def cleanup_finished(self) -> int:
-        now = time.time()
-        ttl = settings.job_retention_seconds
-        removed = 0
-        with self._lock:
-            to_delete = []
-            for job_id, job in self._jobs.items():
-                if job["status"] not in {"completed", "failed"}:
-                    continue
-                finished_at = job.get("finished_at") or job.get("last_updated_at") or job.get("created_at")
-                if finished_at is None:
-                    continue
-                if (now - finished_at) > ttl:
-                    to_delete.append(job_id)
-            for job_id in to_delete:
-                self._jobs.pop(job_id, None)
-                removed += 1
+        # A pass already in progress covers this one; don't queue up behind it.
+        if not self._cleanup_lock.acquire(blocking=False):
+            return 0
+        try:
+            cutoff = time.time() - settings.job_retention_seconds
+            removed = 0
+            while True:
+                with self._lock:
+                    expired = self._expire_finished_locked(cutoff, limit=_EVICTION_BATCH)
+                removed += expired
+                if expired < _EVICTION_BATCH:
+                    break
 
             # Enforce memory pressure guard after TTL cleanup.
-            removed += self._enforce_memory_limit_locked()
-        return removed
+            removed += self.enforce_memory_limit()
+            return removed
+        finally:
+            self._cleanup_lock.release()
+
+    def start_janitor(self, interval_seconds: float) -> None:
+        """Run cleanup_finished periodically on a daemon thread instead of per request."""
+        if self._janitor is not None:
+            return
+        self._janitor_stop.clear()
+
+        def run() -> None:
+            while not self._janitor_stop.wait(interval_seconds):
+                try:
+                    self.cleanup_finished()
+                except Exception:
+                    logger.exception("job_cache_cleanup_failed")
 
-    def _approx_job_size_bytes(self, job: Dict[str, Any]) -> int:
+        self._janitor = threading.Thread(target=run, name="job-store-janitor", daemon=True)
+        self._janitor.start()
+
+    def stop_janitor(self) -> None:
+        if self._janitor is None:
+            return
+        self._janitor_stop.set()
+        self._janitor.join()
+        self._janitor = None
+
+    def _json_size_bytes(self, value: Any) -> int:
         try:
-            return len(json.dumps(job, default=str).encode("utf-8"))
+            return len(json.dumps(value, default=str).encode("utf-8"))
         except Exception:
             return 0
 
-    def _memory_usage_bytes_locked(self) -> int:
-        return sum(self._approx_job_size_bytes(job) for job in self._jobs.values())
+    def _estimate_field_bytes(self, value: Any) -> int:
+        return len(value) if isinstance(value, str) else 0
+
+    def _estimate_job_bytes(self, job: Dict[str, Any]) -> int:
+        return (
+            self._job_header_bytes
+            + len(job.get("chunk_sizes") or ()) * _CHUNK_SIZE_ENTRY_BYTES
+            + self._estimate_field_bytes(job.get("error_message"))
+            + job["results"].size_bytes
+        )
+
+    def _store_locked(self, record: Dict[str, Any]) -> None:
+        job_id = record["job_id"]
+        self._discard_locked(job_id)
+        size = self._estimate_job_bytes(record)
+        self._jobs[job_id] = record
+        self._job_sizes[job_id] = size
+        self._total_bytes += size
+        self._push_if_terminal_locked(record)
+
+    def _discard_locked(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = self._jobs.pop(job_id, None)
+        self._total_bytes -= self._job_sizes.pop(job_id, 0)
+        self._fetched_at.pop(job_id, None)
+        if len(self._evict_heap) > 2 * len(self._jobs) + 64:
+            # Drop entries left behind by removed or re-keyed jobs.
+            self._evict_heap = [
+                (self._eviction_key(live), live_id)
+                for live_id, live in self._jobs.items()
+                if live.get("status") in _TERMINAL_STATUSES
+            ]
+            heapq.heapify(self._evict_heap)
+        return job
+
+    def _eviction_key(self, job: Dict[str, Any]) -> float:
+        return job.get("finished_at") or job.get("last_updated_at") or job.get("created_at") or 0
 
-    def _enforce_memory_limit_locked(self) -> int:
-        max_bytes = int(settings.max_stored_results_memory_mb * 1024 * 1024)
+    def _push_if_terminal_locked(self, job: Dict[str, Any]) -> None:
+        if job.get("status") in _TERMINAL_STATUSES:
+            heapq.heappush(self._evict_heap, (self._eviction_key(job), job["job_id"]))
+
+    def _adjust_size_locked(self, job_id: str, delta: int) -> None:
+        self._job_sizes[job_id] += delta
+        self._total_bytes += delta
+
+    def _next_candidate_locked(self, cutoff: Optional[float] = None) -> Optional[str]:
+        """Pop heap entries until a live terminal job turns up, stopping at the first entry not older than cutoff."""
+        while self._evict_heap:
+            finished_at, job_id = self._evict_heap[0]
+            if cutoff is not None and finished_at >= cutoff:
+                return None
+            heapq.heappop(self._evict_heap)
+            job = self._jobs.get(job_id)
+            if job is not None and job.get("status") in _TERMINAL_STATUSES and self._eviction_key(job) == finished_at:
+                return job_id
+        return None
+
+    def _expire_finished_locked(self, cutoff: float, limit: int) -> int:
+        removed = 0
+        while removed < limit:
+            job_id = self._next_candidate_locked(cutoff)
+            if job_id is None:
+                break
+            self._discard_locked(job_id)
+            removed += 1
+        return removed
+
+    def _enforce_memory_limit_locked(self, limit: Optional[int] = None) -> int:
+        # The cap covers all worker processes together.
+        max_bytes = int(settings.max_stored_results_memory_mb * 1024 * 1024 / max(1, settings.web_concurrency))
         if max_bytes <= 0:
             return 0
         removed = 0
-        while self._memory_usage_bytes_locked() > max_bytes:
-            candidates = [
-                (job_id, job)
-                for job_id, job in self._jobs.items()
-                if job.get("status") in {"completed", "failed"}
-            ]
-            if not candidates:
+        while self._total_bytes > max_bytes and (limit is None or removed < limit):
+            job_id = self._next_candidate_locked()
+            if job_id is None:
                 break
-            oldest_id, _ = min(
-                candidates,
-                key=lambda item: (
-                    item[1].get("finished_at")
-                    or item[1].get("last_updated_at")
-                    or item[1].get("created_at")
-                    or 0
-                ),
-            )
-            self._jobs.pop(oldest_id, None)
+            self._discard_locked(job_id)
             removed += 1
+        return removed
+
+    def _log_eviction(self, removed: int) -> None:
         if removed:
             logger.warning(
                 "job_cache_eviction",
@@ -180,11 +374,16 @@ class InMemoryJobStore:
                     "memory_limit_mb": settings.max_stored_results_memory_mb,
                 },
             )
-        return removed
 
     def enforce_memory_limit(self) -> int:
-        with self._lock:
-            return self._enforce_memory_limit_locked()
-
+        removed = 0
+        while True:
+            with self._lock:
+                evicted = self._enforce_memory_limit_locked(limit=_EVICTION_BATCH)
+            removed += evicted
+            if evicted < _EVICTION_BATCH:
+                break
+        self._log_eviction(removed)
+        return removed
 
 job_store = InMemoryJobStore()
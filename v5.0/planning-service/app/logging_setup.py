@@ -1,14 +1,16 @@
-import json
 import logging
 from datetime import datetime, timezone
 
+import orjson
+
 from app.config import settings
 
 
 class JsonFormatter(logging.Formatter):
     def format(self, record: logging.LogRecord) -> str:
         payload = {
-            "timestamp": datetime.now(timezone.utc).isoformat(),
+            # orjson serializes datetimes natively as RFC 3339.
+            "timestamp": datetime.fromtimestamp(record.created, tz=timezone.utc),
             "level": record.levelname,
             "logger": record.name,
             "message": record.getMessage(),
@@ -30,8 +32,12 @@ class JsonFormatter(logging.Formatter):
             if value is not None:
                 payload[key] = value
         if record.exc_info:
-            payload["exception"] = self.formatException(record.exc_info)
-        return json.dumps(payload, ensure_ascii=True)
+            # Formatted only here, i.e. once a record has passed the level
+            # checks, and cached on the record for any further handler.
+            if not record.exc_text:
+                record.exc_text = self.formatException(record.exc_info)
+            payload["exception"] = record.exc_text
+        return orjson.dumps(payload, default=str).decode()
 
 
 def configure_logging() -> None:
@@ -42,5 +48,6 @@ def configure_logging() -> None:
     # Replace default handlers with structured JSON output.
     root_logger.handlers = []
     handler = logging.StreamHandler()
+    handler.setLevel(level)
     handler.setFormatter(JsonFormatter())
     root_logger.addHandler(handler)
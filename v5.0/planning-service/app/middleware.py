@@ -1,138 +1,230 @@
 import logging
+import math
 import time
 import uuid
 import asyncio
-from collections import deque
+from collections import OrderedDict
+from itertools import count
 from threading import Lock
 
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.requests import Request
-from starlette.responses import JSONResponse
+import orjson
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import Response
 
 from app.config import settings
 
 logger = logging.getLogger("planning-service")
 
 
-class RequestContextMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        request_id = request.headers.get("x-request-id", str(uuid.uuid4()))
-        request.state.request_id = request_id
-        started = time.perf_counter()
+def _error_body(code: str, message: str) -> bytes:
+    return orjson.dumps({"error": {"code": code, "message": message}})
+
+
+def _error_response(status_code: int, body: bytes, headers: dict | None = None) -> Response:
+    return Response(content=body, status_code=status_code, headers=headers, media_type="application/json")
+
+
+# Rejection bodies never vary per request, so they are serialized once.
+_INVALID_CONTENT_LENGTH_BODY = _error_body("invalid_content_length", "Invalid Content-Length header.")
+_RATE_LIMITED_BODY = _error_body("rate_limit_exceeded", "Too many requests. Please retry later.")
+_TIMEOUT_BODY = _error_body("request_timeout", f"Request exceeded {settings.request_timeout_seconds} seconds.")
+
+
+def _client_ip(scope) -> str:
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+class _PayloadTooLarge(Exception):
+    pass
+
+
+class InMemoryRateLimiter:
+    """Per-IP token bucket: ``max_requests`` burst, refilled evenly over the window."""
+
+    __slots__ = (
+        "window_seconds",
+        "max_requests",
+        "refill_per_second",
+        "_shards",
+        "_shard_capacity",
+        "_request_counter",
+    )
+
+    # Drop idle per-IP buckets once every this many requests.
+    sweep_interval_requests = 1000
+    shard_count = 64
+
+    def __init__(self):
+        self.window_seconds = settings.rate_limit_window_seconds
+        # Buckets are per process; split the limit across workers so an
+        # IP's total stays near the configured rate under Gunicorn.
+        self.max_requests = max(1, math.ceil(settings.rate_limit_requests_per_window / max(1, settings.web_concurrency)))
+        self.refill_per_second = self.max_requests / self.window_seconds
+        # Clients hash onto fixed shards, each with its own lock and an LRU of
+        # client_ip -> (tokens, last_refill) capped so that unique IPs cannot
+        # grow the table without bound.
+        self._shards: list[tuple[Lock, OrderedDict[str, tuple[float, float]]]] = [
+            (Lock(), OrderedDict()) for _ in range(self.shard_count)
+        ]
+        self._shard_capacity = max(1, settings.rate_limit_max_tracked_ips // self.shard_count)
+        self._request_counter = count(1)
+
+    def acquire(self, client_ip: str) -> int | None:
+        """Take a token for ``client_ip``; returns the retry-after seconds if none is left."""
+        now = time.monotonic()
+
+        lock, buckets = self._shards[hash(client_ip) % self.shard_count]
+        with lock:
+            bucket = buckets.get(client_ip)
+            if bucket is None:
+                tokens = float(self.max_requests)
+            else:
+                tokens = min(self.max_requests, bucket[0] + (now - bucket[1]) * self.refill_per_second)
+            admitted = tokens >= 1
+            buckets[client_ip] = (tokens - 1 if admitted else tokens, now)
+            buckets.move_to_end(client_ip)
+            if len(buckets) > self._shard_capacity:
+                buckets.popitem(last=False)
+
+        if not admitted:
+            return math.ceil((1 - tokens) / self.refill_per_second)
+
+        if next(self._request_counter) % self.sweep_interval_requests == 0:
+            self._sweep_idle_clients(now)
+        return None
+
+    def _sweep_idle_clients(self, now: float) -> None:
+        # A bucket untouched for a whole window has refilled completely, so
+        # dropping it is indistinguishable from keeping it. Each shard is kept
+        # in LRU order, so idle buckets sit at the front.
+        for lock, buckets in self._shards:
+            if not lock.acquire(blocking=False):
+                continue
+            try:
+                while buckets:
+                    client_ip, (_, last_refill) = next(iter(buckets.items()))
+                    if (now - last_refill) <= self.window_seconds:
+                        break
+                    del buckets[client_ip]
+            finally:
+                lock.release()
+
+
+class ServiceMiddleware:
+    """
+    Rate limit, payload limit, request context and timeout in one plain ASGI
+    layer, so each request gets a single wrapped receive/send pair and frame
+    rather than one per concern (BaseHTTPMiddleware would also add a task and
+    a memory stream each).
+
+    Checks run cheapest-first: the rate limit, then the Content-Length cap.
+    Bodies without a usable Content-Length are counted as the app receives
+    them, so a chunked upload is cut off at the limit instead of being
+    buffered whole.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.max_bytes = settings.max_request_body_bytes
+        self.timeout_seconds = settings.request_timeout_seconds
+        self.slow_request_ms = settings.slow_request_log_ms
+        self.rate_limiter = InMemoryRateLimiter()
+        self._too_large_body = _error_body("payload_too_large", f"Request body exceeds {self.max_bytes} bytes.")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        # Assigned before any check so every response, rejections included,
+        # carries it and exception handlers can read request.state.request_id
+        # directly.
+        request_id = headers.get("x-request-id") or str(uuid.uuid4())
+        scope.setdefault("state", {})["request_id"] = request_id
+        started_ns = time.monotonic_ns()
+        status_code = None
+        rejected_too_large = False
+
+        async def send_with_request_id(message):
+            nonlocal status_code
+            if rejected_too_large:
+                # The 413 already went out from limited_receive; whatever the
+                # app answers to its failed body read is dropped.
+                return
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                MutableHeaders(scope=message)["x-request-id"] = request_id
+            await send(message)
+
+        client_ip = _client_ip(scope)
+        retry_after = self.rate_limiter.acquire(client_ip)
+        if retry_after is not None:
+            response = _error_response(429, _RATE_LIMITED_BODY, headers={"retry-after": str(retry_after)})
+            await response(scope, receive, send_with_request_id)
+            return
+
         request_size = None
-        length_header = request.headers.get("content-length")
+        length_header = headers.get("content-length")
         if length_header is not None:
             try:
                 request_size = int(length_header)
             except ValueError:
-                request_size = None
-
-        response = await call_next(request)
-        response.headers["x-request-id"] = request_id
+                await _error_response(400, _INVALID_CONTENT_LENGTH_BODY)(scope, receive, send_with_request_id)
+                return
+            if request_size > self.max_bytes:
+                await _error_response(413, self._too_large_body)(scope, receive, send_with_request_id)
+                return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received, rejected_too_large
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # FastAPI wraps errors raised while reading the body into a
+                    # 400 "error parsing the body", so the 413 is sent here,
+                    # before the app gets a chance to answer.
+                    if status_code is None and not rejected_too_large:
+                        await _error_response(413, self._too_large_body)(scope, receive, send_with_request_id)
+                        rejected_too_large = True
+                    raise _PayloadTooLarge()
+            return message
 
-        duration_ms = round((time.perf_counter() - started) * 1000, 2)
+        try:
+            if self.timeout_seconds > 0:
+                await asyncio.wait_for(self.app(scope, limited_receive, send_with_request_id), self.timeout_seconds)
+            else:
+                await self.app(scope, limited_receive, send_with_request_id)
+        except _PayloadTooLarge:
+            if not rejected_too_large:
+                # Headers are already out; all that is left is to drop the connection.
+                raise
+        except asyncio.TimeoutError:
+            if not rejected_too_large:
+                if status_code is not None:
+                    raise
+                await _error_response(504, _TIMEOUT_BODY)(scope, receive, send_with_request_id)
+
+        # The access log proper is off (see main.py); only failed or slow
+        # requests get a record, built only when it will actually be emitted.
+        duration_ms = (time.monotonic_ns() - started_ns) // 1_000_000
+        if (status_code or 500) < 400 and duration_ms < self.slow_request_ms:
+            return
+        if not logger.isEnabledFor(logging.INFO):
+            return
         logger.info(
             "request_completed",
             extra={
                 "request_id": request_id,
-                "path": request.url.path,
-                "method": request.method,
-                "status_code": response.status_code,
+                "path": scope["path"],
+                "method": scope["method"],
+                "status_code": status_code,
                 "duration_ms": duration_ms,
-                "client_ip": request.client.host if request.client else "unknown",
+                "client_ip": client_ip,
                 "request_size_bytes": request_size,
             },
         )
-        return response
-
-
-class PayloadSizeLimitMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        length_header = request.headers.get("content-length")
-        if length_header is not None:
-            try:
-                length = int(length_header)
-            except ValueError:
-                return JSONResponse(
-                    status_code=400,
-                    content={
-                        "error": {
-                            "code": "invalid_content_length",
-                            "message": "Invalid Content-Length header.",
-                        }
-                    },
-                )
-            if length > settings.max_request_body_bytes:
-                return JSONResponse(
-                    status_code=413,
-                    content={
-                        "error": {
-                            "code": "payload_too_large",
-                            "message": f"Request body exceeds {settings.max_request_body_bytes} bytes.",
-                        }
-                    },
-                )
-        else:
-            # For chunked uploads without Content-Length, enforce limit on actual body size.
-            body = await request.body()
-            if len(body) > settings.max_request_body_bytes:
-                return JSONResponse(
-                    status_code=413,
-                    content={
-                        "error": {
-                            "code": "payload_too_large",
-                            "message": f"Request body exceeds {settings.max_request_body_bytes} bytes.",
-                        }
-                    },
-                )
-        return await call_next(request)
-
-
-class InMemoryRateLimitMiddleware(BaseHTTPMiddleware):
-    def __init__(self, app):
-        super().__init__(app)
-        self.window_seconds = settings.rate_limit_window_seconds
-        self.max_requests = settings.rate_limit_requests_per_window
-        self._lock = Lock()
-        self._requests_by_ip: dict[str, deque[float]] = {}
-
-    async def dispatch(self, request: Request, call_next):
-        client_ip = request.client.host if request.client else "unknown"
-        now = time.time()
-
-        with self._lock:
-            queue = self._requests_by_ip.setdefault(client_ip, deque())
-            while queue and (now - queue[0]) > self.window_seconds:
-                queue.popleft()
-
-            if len(queue) >= self.max_requests:
-                return JSONResponse(
-                    status_code=429,
-                    content={
-                        "error": {
-                            "code": "rate_limit_exceeded",
-                            "message": "Too many requests. Please retry later.",
-                        }
-                    },
-                    headers={"retry-after": str(self.window_seconds)},
-                )
-
-            queue.append(now)
-
-        return await call_next(request)
-
-
-class RequestTimeoutMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        try:
-            return await asyncio.wait_for(call_next(request), timeout=settings.request_timeout_seconds)
-        except asyncio.TimeoutError:
-            return JSONResponse(
-                status_code=504,
-                content={
-                    "error": {
-                        "code": "request_timeout",
-                        "message": f"Request exceeded {settings.request_timeout_seconds} seconds.",
-                    }
-                },
-            )
@@ -1,6 +1,7 @@
-from typing import List, Literal, Optional
+from typing import Annotated, List, Literal, Optional
 
-from pydantic import BaseModel, Field
+import msgspec
+from pydantic import BaseModel
 
 
 MAX_SCHEMA_POINTS = 10_000_000
@@ -8,14 +9,20 @@ SECURE_MAX_POINTS = 100_000
 CHUNK_SIZE = 1_000
 
 
-class CoordinatePoint(BaseModel):
+# Upload bodies are decoded with msgspec (as /routing/compute-batch does):
+# the whole coordinate list is parsed and bounds-checked in one C pass into
+# small structs instead of a Pydantic model per point.
+class CoordinatePoint(msgspec.Struct):
     id: int
-    lat: float = Field(ge=-90, le=90)
-    lon: float = Field(ge=-180, le=180)
+    lat: Annotated[float, msgspec.Meta(ge=-90, le=90)]
+    lon: Annotated[float, msgspec.Meta(ge=-180, le=180)]
 
 
-class BatchUploadRequest(BaseModel):
-    coordinates: List[CoordinatePoint] = Field(min_length=1, max_length=MAX_SCHEMA_POINTS)
+class BatchUploadRequest(msgspec.Struct):
+    coordinates: Annotated[List[CoordinatePoint], msgspec.Meta(min_length=1, max_length=MAX_SCHEMA_POINTS)]
+
+
+batch_upload_request_decoder = msgspec.json.Decoder(BatchUploadRequest)
 
 
 class BatchUploadResponse(BaseModel):
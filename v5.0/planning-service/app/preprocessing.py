@@ -1,17 +1,38 @@
+import array
 import time
-from typing import Callable, Dict, Generator, List, Sequence, TypeVar
+from itertools import islice
+from typing import Callable, Dict, Generator, Iterable, List, Mapping, Sequence, TypeVar
 
 from app.config import settings
 
 
 T = TypeVar("T")
 
+# A batch held as parallel typed arrays ("id", "lat", "lon") rather than one
+# object per point. Chunks of it are zero-copy memoryview slices.
+CoordinateColumns = Mapping[str, Sequence]
 
-def chunk_generator(items: Sequence[T], chunk_size: int) -> Generator[List[T], None, None]:
+
+def chunk_generator(items: Iterable[T], chunk_size: int) -> Generator[List[T], None, None]:
     if chunk_size <= 0:
         raise ValueError("chunk_size must be greater than 0")
-    for start in range(0, len(items), chunk_size):
-        yield list(items[start : start + chunk_size])
+    # One pass over a single iterator; no intermediate slice copy per chunk.
+    it = iter(items)
+    while block := list(islice(it, chunk_size)):
+        yield block
+
+
+def coordinate_columns(ids: Iterable[int], lats: Iterable[float], lons: Iterable[float]) -> Dict[str, array.array]:
+    return {"id": array.array("q", ids), "lat": array.array("d", lats), "lon": array.array("d", lons)}
+
+
+def columnar_chunks(columns: CoordinateColumns, chunk_size: int) -> Generator[Dict[str, memoryview], None, None]:
+    if chunk_size <= 0:
+        raise ValueError("chunk_size must be greater than 0")
+    views = {name: memoryview(values) for name, values in columns.items()}
+    total = len(views["id"])
+    for start in range(0, total, chunk_size):
+        yield {name: view[start : start + chunk_size] for name, view in views.items()}
 
 
 def compute_chunk_sizes(total_points: int, chunk_size: int) -> List[int]:
@@ -24,22 +45,31 @@ def compute_chunk_sizes(total_points: int, chunk_size: int) -> List[int]:
     return sizes
 
 
-def mock_chunk_processor(chunk: Sequence[T], chunk_index: int) -> Dict:
+# Settings are fixed for the process lifetime, so the mock delay is read once.
+# Each call holds a CHUNK_EXECUTOR worker for the delay, which caps a job at
+# ceil(chunks / workers) * delay: 100 chunks on 8 workers at 0.1 s take at
+# least 1.25 s. MOCK_CHUNK_DELAY_SECONDS=0 removes the sleep entirely, which
+# is what load and benchmark runs should use.
+_MOCK_CHUNK_DELAY_SECONDS = settings.mock_chunk_delay_seconds
+
+
+def mock_chunk_processor(chunk: CoordinateColumns, chunk_index: int) -> Dict:
     """
     Placeholder processor for future routing integration.
     """
-    time.sleep(settings.mock_chunk_delay_seconds)
+    if _MOCK_CHUNK_DELAY_SECONDS > 0:
+        time.sleep(_MOCK_CHUNK_DELAY_SECONDS)
     return {
         "chunk_index": chunk_index,
-        "processed_points": len(chunk),
+        "processed_points": len(chunk["id"]),
         "status": "ok",
     }
 
 
-_chunk_processor: Callable[[Sequence[T], int], Dict] = mock_chunk_processor
+_chunk_processor: Callable[[CoordinateColumns, int], Dict] = mock_chunk_processor
 
 
-def set_chunk_processor(processor: Callable[[Sequence[T], int], Dict]) -> None:
+def set_chunk_processor(processor: Callable[[CoordinateColumns, int], Dict]) -> None:
     """
     Allows future routing engine injection without changing endpoint code.
     """
@@ -47,18 +77,15 @@ def set_chunk_processor(processor: Callable[[Sequence[T], int], Dict]) -> None:
     _chunk_processor = processor
 
 
-def get_chunk_processor() -> Callable[[Sequence[T], int], Dict]:
+def get_chunk_processor() -> Callable[[CoordinateColumns, int], Dict]:
     return _chunk_processor
 
 
 def process_chunks(
-    items: Sequence[T],
+    columns: CoordinateColumns,
     chunk_size: int,
-    processor: Callable[[Sequence[T], int], Dict] | None = None,
+    processor: Callable[[CoordinateColumns, int], Dict] | None = None,
 ) -> List[Dict]:
     if processor is None:
         processor = _chunk_processor
-    results: List[Dict] = []
-    for idx, chunk in enumerate(chunk_generator(items, chunk_size)):
-        results.append(processor(chunk, idx))
-    return results
+    return [processor(chunk, idx) for idx, chunk in enumerate(columnar_chunks(columns, chunk_size))]
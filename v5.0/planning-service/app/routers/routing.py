@@ -1,8 +1,11 @@
-from fastapi import APIRouter, HTTPException
+import msgspec
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.exceptions import RequestValidationError
 
 from app.db import get_db
 from app.errors import AppError
-from app.schemas import BatchRouteRequest, BatchRouteResponse, ConsumerRouteRequest, ConsumerRouteResponse
+from app.schemas import BatchRouteResponse, ConsumerRouteRequest, ConsumerRouteResponse, batch_route_request_decoder
 from app.services.planning_service import PlanningService
 
 router = APIRouter(prefix="/routing", tags=["routing"])
@@ -22,15 +25,32 @@ def compute_route(payload: ConsumerRouteRequest):
         raise HTTPException(status_code=exc.status_code, detail={"code": exc.code, "message": exc.message}) from exc
 
 
+def _run_batch(coordinates, include_geometry):
+    with get_db() as conn:
+        service = PlanningService(conn)
+        return service.compute_batch(coordinates=coordinates, include_geometry=include_geometry)
+
+
 @router.post("/compute-batch", response_model=BatchRouteResponse)
-def compute_batch_route(payload: BatchRouteRequest):
+async def compute_batch_route(request: Request):
+    body = await request.body()
     try:
-        with get_db() as conn:
-            service = PlanningService(conn)
-            result = service.compute_batch(
-                coordinates=[item.model_dump() for item in payload.coordinates],
-                include_geometry=payload.include_geometry,
-            )
-        return result
+        payload = batch_route_request_decoder.decode(body)
+    except msgspec.ValidationError as exc:
+        raise RequestValidationError([{"type": "value_error", "loc": ("body",), "msg": str(exc)}]) from exc
+    except msgspec.DecodeError as exc:
+        raise RequestValidationError([{"type": "json_invalid", "loc": ("body",), "msg": str(exc)}]) from exc
+
+    if payload.include_geometry:
+        raise HTTPException(
+            status_code=400,
+            detail={"code": "unsupported_option", "message": "Geometry output is disabled for batch mode."},
+        )
+
+    try:
+        # The decoded structs go to the service as-is; it reads their
+        # attributes directly instead of working on a builtins copy.
+        result = await run_in_threadpool(_run_batch, payload.coordinates, payload.include_geometry)
     except AppError as exc:
         raise HTTPException(status_code=exc.status_code, detail={"code": exc.code, "message": exc.message}) from exc
+    return Response(content=msgspec.json.encode(result), media_type="application/json")
@@ -1,25 +1,30 @@
 import logging
 import time
-from concurrent.futures import TimeoutError
-from typing import Any, Dict, List, Optional
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from operator import itemgetter
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple
 
+import msgspec
 from fastapi import APIRouter, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.exceptions import RequestValidationError
 from starlette.status import HTTP_202_ACCEPTED
 
 from app.config import settings
 from app.executor_pool import CHUNK_EXECUTOR, JOB_EXECUTOR
-from app.job_repository import job_repository
+from app.job_repository import chunk_result_writer, job_repository
 from app.job_store import job_store
 from app.models import (
     BatchUploadAccepted,
-    BatchUploadRequest,
     CHUNK_SIZE,
+    CoordinatePoint,
     JobMetricsResponse,
     JobResultResponse,
     JobStatusResponse,
     SECURE_MAX_POINTS,
+    batch_upload_request_decoder,
 )
-from app.preprocessing import chunk_generator, get_chunk_processor
+from app.preprocessing import CoordinateColumns, columnar_chunks, compute_chunk_sizes, coordinate_columns, get_chunk_processor
 
 logger = logging.getLogger("planning-service")
 
@@ -31,18 +36,11 @@ def _hydrate_job_record_from_db(job_id: str) -> Optional[Dict[str, Any]]:
     if not job:
         return None
     chunk_rows = job_repository.get_chunk_results(job_id)
-    chunk_sizes = [CHUNK_SIZE] * (job["total_chunks"] - 1) + (
-        [job["total_points"] - (CHUNK_SIZE * (job["total_chunks"] - 1))] if job["total_chunks"] > 0 else []
-    )
-    if job["total_chunks"] == 1:
-        chunk_sizes = [job["total_points"]]
-    avg_chunk = 0.0
-    max_chunk = 0
-    if chunk_rows:
-        durations = [int(r.get("duration_ms") or 0) for r in chunk_rows]
-        avg_chunk = float(sum(durations) / len(durations))
-        max_chunk = max(durations)
-    total_processing_time = int(sum(int(r.get("duration_ms") or 0) for r in chunk_rows))
+    chunk_sizes = compute_chunk_sizes(job["total_points"], CHUNK_SIZE)
+    durations = [int(r["duration_ms"] or 0) for r in chunk_rows]
+    total_processing_time = sum(durations)
+    avg_chunk = float(total_processing_time / len(durations)) if durations else 0.0
+    max_chunk = max(durations, default=0)
     return {
         "job_id": job["job_id"],
         "status": job["status"],
@@ -51,16 +49,8 @@ def _hydrate_job_record_from_db(job_id: str) -> Optional[Dict[str, Any]]:
         "chunk_sizes": chunk_sizes,
         "processed_chunks": job["processed_chunks"],
         "failed_chunks": job["failed_chunks"],
-        "results": [
-            {
-                "chunk_index": r["chunk_index"],
-                "processed_points": r["processed_points"],
-                "status": r["status"],
-                "error_message": r["error_message"],
-                "duration_ms": r["duration_ms"],
-            }
-            for r in chunk_rows
-        ],
+        # Rows already carry exactly the result keys, ordered by chunk_index.
+        "results": chunk_rows,
         "error_message": job["error_message"],
         "created_at": job["created_at"],
         "started_at": job["started_at"],
@@ -72,91 +62,161 @@ def _hydrate_job_record_from_db(job_id: str) -> Optional[Dict[str, Any]]:
     }
 
 
-def _get_job_from_cache_or_db(job_id: str) -> Optional[Dict[str, Any]]:
-    cached = job_store.get_job(job_id)
-    if cached:
+def _get_job_from_cache_or_db(job_id: str) -> Optional[Mapping[str, Any]]:
+    cached, fetched_at = job_store.get_job_with_ts(job_id)
+    if cached and (
+        # Jobs running in this process are updated in place; terminal jobs no longer change.
+        fetched_at is None
+        or cached["status"] in {"completed", "failed"}
+        or (time.monotonic() - fetched_at) < settings.job_status_refresh_seconds
+    ):
         return cached
     hydrated = _hydrate_job_record_from_db(job_id)
     if hydrated:
-        job_store.set_job(hydrated)
-        return hydrated
-    return None
+        return job_store.set_job(hydrated)
+    return cached
+
+
+def _failed_chunk_result(idx: int, chunk_len: int, error_message: str, duration_ms: int) -> Dict[str, Any]:
+    return {
+        "chunk_index": idx,
+        "processed_points": chunk_len,
+        "status": "failed",
+        "error_message": error_message,
+        "duration_ms": duration_ms,
+    }
+
+
+def _completed_chunk_result(future: Future, idx: int, chunk_len: int, duration_ms: int) -> Tuple[Dict[str, Any], bool]:
+    try:
+        result = future.result()
+        if not isinstance(result, dict):
+            raise ValueError("Chunk processor must return a dictionary.")
+    except Exception as exc:
+        return _failed_chunk_result(idx, chunk_len, str(exc), duration_ms), True
+    result.setdefault("chunk_index", idx)
+    result.setdefault("processed_points", chunk_len)
+    result.setdefault("status", "ok")
+    result.setdefault("duration_ms", duration_ms)
+    return result, result.get("status") != "ok"
+
+
+# Bound once at import; _record_chunk_result runs for every finished chunk.
+_append_result = job_store.append_result
+_submit_chunk_row = chunk_result_writer.submit
+
+
+def _record_chunk_result(job_id: str, result: Dict[str, Any], failed: bool) -> None:
+    _append_result(job_id, result, failed=failed)
+    _submit_chunk_row(
+        job_id=job_id,
+        chunk_index=result["chunk_index"],
+        processed_points=result["processed_points"],
+        status="failed" if failed else "ok",
+        error_message=result.get("error_message"),
+        duration_ms=int(result.get("duration_ms") or 0),
+    )
+
+
+def _run_chunk(processor: Callable[[CoordinateColumns, int], Dict], chunk, idx: int, started: List[float]) -> Dict:
+    # Runs on a CHUNK_EXECUTOR thread; the stamp is when work actually began,
+    # not when the chunk was queued behind other jobs' chunks.
+    started.append(time.perf_counter())
+    return processor(chunk, idx)
 
 
-def _process_job_in_background(job_id: str, coordinates: list):
-    processor = get_chunk_processor()
+def _process_job_in_background(
+    job_id: str,
+    columns: CoordinateColumns,
+    processor: Callable[[CoordinateColumns, int], Dict],
+):
+    # Loop-invariant lookups bound once; the loop below runs per chunk.
+    timeout = settings.chunk_timeout_seconds
+    max_in_flight = settings.chunk_executor_max_workers
+    submit = CHUNK_EXECUTOR.submit
+    perf_counter = time.perf_counter
+    record = _record_chunk_result
+    run_chunk = _run_chunk
     try:
         job_store.update_job(job_id, status="processing", started_at=time.time(), error_message=None)
         job_repository.update_job_status(job_id, status="processing", started_at_now=True, error_message=None)
 
         had_failures = False
-        for idx, chunk in enumerate(chunk_generator(coordinates, CHUNK_SIZE)):
-            chunk_started = time.perf_counter()
-            try:
-                future = CHUNK_EXECUTOR.submit(processor, chunk, idx)
-                result = future.result(timeout=settings.chunk_timeout_seconds)
-                duration_ms = int((time.perf_counter() - chunk_started) * 1000)
-
-                if not isinstance(result, dict):
-                    raise ValueError("Chunk processor must return a dictionary.")
-                result.setdefault("chunk_index", idx)
-                result.setdefault("processed_points", len(chunk))
-                result.setdefault("status", "ok")
-                result.setdefault("duration_ms", duration_ms)
-                failed = result.get("status") != "ok"
-                if failed:
+        chunks = enumerate(columnar_chunks(columns, CHUNK_SIZE))
+        exhausted = False
+        # Keep up to one chunk per CHUNK_EXECUTOR worker in flight; the window
+        # is the backpressure that stops a large job from queueing every chunk.
+        # Concurrent jobs share the executor, so a chunk may wait in its queue:
+        # the timeout runs from the moment the processor starts (the list is
+        # filled in by _run_chunk), never from submission.
+        in_flight: Dict[Future, Tuple[int, int, List[float]]] = {}
+        # cancel() cannot stop a chunk that is already running, so a timed-out
+        # chunk keeps its executor thread (and DB connection) until it returns.
+        # It is recorded as failed right away but keeps its window slot here.
+        timed_out: set[Future] = set()
+        while in_flight or not exhausted:
+            timed_out = {future for future in timed_out if not future.done()}
+            while not exhausted and len(in_flight) + len(timed_out) < max_in_flight:
+                next_chunk = next(chunks, None)
+                if next_chunk is None:
+                    exhausted = True
+                    break
+                idx, chunk = next_chunk
+                chunk_len = len(chunk["id"])
+                started: List[float] = []
+                try:
+                    in_flight[submit(run_chunk, processor, chunk, idx, started)] = (idx, chunk_len, started)
+                except Exception as exc:
                     had_failures = True
+                    record(job_id, _failed_chunk_result(idx, chunk_len, str(exc), 0), failed=True)
+            if not in_flight:
+                if timed_out and not exhausted:
+                    # The whole window is held by hung chunks; wait for one to free up.
+                    wait(timed_out, return_when=FIRST_COMPLETED)
+                    continue
+                break
 
-                job_store.append_result(job_id, result, failed=failed)
-                job_repository.persist_chunk_result(
-                    job_id=job_id,
-                    chunk_index=result["chunk_index"],
-                    processed_points=result["processed_points"],
-                    status="failed" if failed else "ok",
-                    error_message=result.get("error_message"),
-                    duration_ms=int(result.get("duration_ms") or duration_ms),
-                )
-            except TimeoutError:
-                had_failures = True
-                duration_ms = int((time.perf_counter() - chunk_started) * 1000)
-                timeout_result = {
-                    "chunk_index": idx,
-                    "processed_points": len(chunk),
-                    "status": "failed",
-                    "error_message": f"Chunk timeout after {settings.chunk_timeout_seconds} seconds.",
-                    "duration_ms": duration_ms,
-                }
-                job_store.append_result(job_id, timeout_result, failed=True)
-                job_repository.persist_chunk_result(
-                    job_id=job_id,
-                    chunk_index=idx,
-                    processed_points=len(chunk),
-                    status="failed",
-                    error_message=timeout_result["error_message"],
-                    duration_ms=duration_ms,
-                )
-            except Exception as exc:
-                had_failures = True
-                duration_ms = int((time.perf_counter() - chunk_started) * 1000)
-                failed_result = {
-                    "chunk_index": idx,
-                    "processed_points": len(chunk),
-                    "status": "failed",
-                    "error_message": str(exc),
-                    "duration_ms": duration_ms,
-                }
-                job_store.append_result(job_id, failed_result, failed=True)
-                job_repository.persist_chunk_result(
-                    job_id=job_id,
-                    chunk_index=idx,
-                    processed_points=len(chunk),
-                    status="failed",
-                    error_message=str(exc),
-                    duration_ms=duration_ms,
-                )
-
-        final_status = "failed" if had_failures else "completed"
-        final_error = "One or more chunks failed." if had_failures else None
+            # A chunk that starts during the wait has a deadline past its end,
+            # so waiting at most `timeout` never overshoots one.
+            now = perf_counter()
+            next_deadline = min(
+                (started[0] + timeout for _, _, started in in_flight.values() if started),
+                default=now + timeout,
+            )
+            done, _ = wait(
+                [*in_flight, *timed_out],
+                timeout=max(0.0, next_deadline - now),
+                return_when=FIRST_COMPLETED,
+            )
+            now = perf_counter()
+            for future, (idx, chunk_len, started) in list(in_flight.items()):
+                duration_ms = int((now - started[0]) * 1000) if started else 0
+                if future in done:
+                    result, failed = _completed_chunk_result(future, idx, chunk_len, duration_ms)
+                elif started and now - started[0] >= timeout:
+                    if not future.cancel():
+                        timed_out.add(future)
+                    result = _failed_chunk_result(
+                        idx, chunk_len, f"Chunk timeout after {timeout} seconds.", duration_ms
+                    )
+                    failed = True
+                else:
+                    continue
+                del in_flight[future]
+                had_failures = had_failures or failed
+                record(job_id, result, failed)
+
+        # The final status must not land before this job's chunk counters do.
+        results_persisted = chunk_result_writer.flush(job_id)
+        if not results_persisted:
+            final_status = "failed"
+            final_error = "Chunk results could not be saved."
+        elif had_failures:
+            final_status = "failed"
+            final_error = "One or more chunks failed."
+        else:
+            final_status = "completed"
+            final_error = None
         finished_at = time.time()
         job_store.update_job(job_id, status=final_status, finished_at=finished_at, error_message=final_error)
         job_repository.update_job_status(
@@ -183,9 +243,25 @@ def _process_job_in_background(job_id: str, coordinates: list):
 
 
 @router.post("/upload-batch", response_model=BatchUploadAccepted, status_code=HTTP_202_ACCEPTED)
-def upload_batch(payload: BatchUploadRequest, request: Request):
-    job_store.cleanup_finished()
-    total_points = len(payload.coordinates)
+async def upload_batch(request: Request):
+    body = await request.body()
+    try:
+        payload = batch_upload_request_decoder.decode(body)
+    except msgspec.ValidationError as exc:
+        raise RequestValidationError([{"type": "value_error", "loc": ("body",), "msg": str(exc)}]) from exc
+    except msgspec.DecodeError as exc:
+        raise RequestValidationError([{"type": "json_invalid", "loc": ("body",), "msg": str(exc)}]) from exc
+    del body
+
+    return await run_in_threadpool(
+        _accept_batch,
+        payload.coordinates,
+        getattr(request.state, "request_id", None),
+    )
+
+
+def _accept_batch(points: List[CoordinatePoint], request_id: Optional[str]) -> Dict[str, Any]:
+    total_points = len(points)
     if total_points > SECURE_MAX_POINTS:
         raise HTTPException(
             status_code=413,
@@ -195,10 +271,19 @@ def upload_batch(payload: BatchUploadRequest, request: Request):
             },
         )
 
-    chunk_sizes = [len(chunk) for chunk in chunk_generator(payload.coordinates, CHUNK_SIZE)]
+    chunk_sizes = compute_chunk_sizes(total_points, CHUNK_SIZE)
     total_chunks = len(chunk_sizes)
 
-    # Thread-safe admission against local active queue/load.
+    # Hand the background job three aligned columns and release the
+    # per-point structs.
+    columns = coordinate_columns(
+        (point.id for point in points),
+        (point.lat for point in points),
+        (point.lon for point in points),
+    )
+    points.clear()
+
+    # Cheap local gate first; the database check below is the global one.
     job = job_store.create_job_if_capacity(
         total_points=total_points,
         chunk_sizes=chunk_sizes,
@@ -210,18 +295,32 @@ def upload_batch(payload: BatchUploadRequest, request: Request):
             detail={"code": "server_busy", "message": "Server busy. Try again later."},
         )
 
-    # Persist metadata before execution starts.
+    # Persist metadata before execution starts; this also enforces
+    # max_active_jobs across every worker process.
     try:
-        job_repository.create_job(job["job_id"], total_points=total_points, total_chunks=total_chunks, status="queued")
+        admitted = job_repository.create_job_if_capacity(
+            job["job_id"],
+            total_points=total_points,
+            total_chunks=total_chunks,
+            max_active_jobs=settings.max_active_jobs,
+        )
     except Exception as exc:
         job_store.pop_job(job["job_id"])
         raise HTTPException(
             status_code=503,
             detail={"code": "persistence_error", "message": "Server busy. Try again later."},
         ) from exc
+    if not admitted:
+        job_store.pop_job(job["job_id"])
+        raise HTTPException(
+            status_code=429,
+            detail={"code": "server_busy", "message": "Server busy. Try again later."},
+        )
 
     try:
-        JOB_EXECUTOR.submit(_process_job_in_background, job["job_id"], payload.coordinates)
+        # The processor is bound when the job is accepted, so a job runs to
+        # completion with the processor that was active at submission.
+        JOB_EXECUTOR.submit(_process_job_in_background, job["job_id"], columns, get_chunk_processor())
     except Exception as exc:
         failed_at = time.time()
         job_store.update_job(
@@ -244,7 +343,7 @@ def upload_batch(payload: BatchUploadRequest, request: Request):
     logger.info(
         "batch_queued",
         extra={
-            "request_id": getattr(request.state, "request_id", None),
+            "request_id": request_id,
             "job_id": job["job_id"],
             "total_points": total_points,
             "chunk_size": CHUNK_SIZE,
@@ -263,7 +362,6 @@ def upload_batch(payload: BatchUploadRequest, request: Request):
 
 @router.get("/job-status/{job_id}", response_model=JobStatusResponse)
 def job_status(job_id: str):
-    job_store.cleanup_finished()
     job = _get_job_from_cache_or_db(job_id)
     if not job:
         raise HTTPException(
@@ -285,7 +383,6 @@ def job_status(job_id: str):
 
 @router.get("/job-result/{job_id}", response_model=JobResultResponse)
 def job_result(job_id: str):
-    job_store.cleanup_finished()
     job = _get_job_from_cache_or_db(job_id)
     if not job:
         raise HTTPException(
@@ -308,14 +405,14 @@ def job_result(job_id: str):
         "chunk_sizes": job["chunk_sizes"],
         "processed_chunks": job["processed_chunks"],
         "failed_chunks": job["failed_chunks"],
-        "results": job["results"],
+        # Chunks finish out of order; report them by index.
+        "results": sorted(job["results"], key=itemgetter("chunk_index")),
         "error_message": job["error_message"],
     }
 
 
 @router.get("/jobs/metrics", response_model=JobMetricsResponse)
 def jobs_metrics():
-    job_store.cleanup_finished()
     metrics = job_repository.metrics()
     return {
         "active_jobs": int(metrics["active_jobs"]),
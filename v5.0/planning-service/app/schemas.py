@@ -1,5 +1,6 @@
-from typing import Any, Dict, List, Optional
+from typing import Annotated, Any, Dict, List, Optional
 
+import msgspec
 from pydantic import BaseModel, Field
 
 from app.config import settings
@@ -28,17 +29,25 @@ class ConsumerRouteResponse(BaseModel):
     edge_count: int
 
 
-class CoordinateInput(BaseModel):
-    id: Optional[str] = Field(default=None, max_length=128)
-    latitude: float = Field(ge=-90, le=90)
-    longitude: float = Field(ge=-180, le=180)
+# Batch request bodies are decoded with msgspec rather than Pydantic: large
+# coordinate lists are parsed and bounds-checked in a single C pass.
+class CoordinateInput(msgspec.Struct):
+    latitude: Annotated[float, msgspec.Meta(ge=-90, le=90)]
+    longitude: Annotated[float, msgspec.Meta(ge=-180, le=180)]
+    id: Optional[Annotated[str, msgspec.Meta(max_length=128)]] = None
 
 
-class BatchRouteRequest(BaseModel):
-    coordinates: List[CoordinateInput] = Field(min_length=1, max_length=settings.max_batch_coordinates)
+class BatchRouteRequest(msgspec.Struct):
+    coordinates: Annotated[
+        List[CoordinateInput],
+        msgspec.Meta(min_length=1, max_length=settings.max_batch_coordinates),
+    ]
     include_geometry: bool = False
 
 
+batch_route_request_decoder = msgspec.json.Decoder(BatchRouteRequest)
+
+
 class BatchRouteItem(BaseModel):
     input_index: int
     input_id: Optional[str] = None
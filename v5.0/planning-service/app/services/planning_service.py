@@ -1,268 +1,342 @@
-import json
-from typing import Dict, List, Optional
+from functools import cached_property
+from itertools import chain
+import time
+from threading import Lock
+from typing import Callable, Dict, Hashable, List, Optional, Sequence, TypeVar
 
-from psycopg import Connection
+import shapely
+from cachetools import TTLCache
+from psycopg import Connection, Cursor
+from shapely.geometry import mapping
 
 from app.config import settings
+from app.db import get_db
 from app.errors import AppError
+from app.executor_pool import BATCH_ROUTE_EXECUTOR
+from app.schemas import CoordinateInput
+
+# Envelope padding large enough to include every edge of a franchise.
+FULL_GRAPH_PADDING_DEGREES = 360.0
+
+# Route results keyed on the dataset version and coordinates rounded to ~1 m.
+# Shared by all requests (PlanningService is per-request); a loader run bumps
+# the version, so entries for older data are never hit again and age out.
+LOOKUP_KEY_DECIMALS = 5
+_lookup_cache: TTLCache = TTLCache(maxsize=settings.lookup_cache_size, ttl=settings.lookup_cache_ttl_seconds)
+_lookup_lock = Lock()
+_MISSING = object()
+# (version, monotonic time it was read); re-read at most every data_version_check_seconds.
+_data_version = (0, float("-inf"))
+
+T = TypeVar("T")
+
+
+def _coord_key(longitude: float, latitude: float) -> tuple:
+    return round(longitude, LOOKUP_KEY_DECIMALS), round(latitude, LOOKUP_KEY_DECIMALS)
+
+
+def _current_data_version(cur: Cursor) -> int:
+    global _data_version
+    now = time.monotonic()
+    with _lookup_lock:
+        version, checked_at = _data_version
+    if now - checked_at < settings.data_version_check_seconds:
+        return version
+    cur.execute("SELECT version FROM dataset_version", prepare=True)
+    row = cur.fetchone()
+    version = row["version"] if row else 0
+    with _lookup_lock:
+        _data_version = (version, now)
+    return version
+
+
+def _cached(key: Hashable, compute: Callable[[], T]) -> T:
+    with _lookup_lock:
+        value = _lookup_cache.get(key, _MISSING)
+    if value is _MISSING:
+        value = compute()
+        with _lookup_lock:
+            _lookup_cache[key] = value
+    return value
 
 
 class PlanningService:
     def __init__(self, conn: Connection):
         self.conn = conn
 
-    def health(self) -> Dict[str, bool]:
-        with self.conn.cursor() as cur:
-            cur.execute("SELECT 1 AS ok")
-            db_ok = cur.fetchone()["ok"] == 1
-
-            cur.execute("SELECT EXISTS(SELECT 1 FROM pg_extension WHERE extname = 'postgis') AS ok")
-            postgis_ok = bool(cur.fetchone()["ok"])
+    @cached_property
+    def _cursor(self) -> Cursor:
+        # One client-side cursor reused by every helper for the lifetime of the
+        # request; it goes away with the service object.
+        return self.conn.cursor()
 
-            cur.execute("SELECT EXISTS(SELECT 1 FROM pg_extension WHERE extname = 'pgrouting') AS ok")
-            pgrouting_ok = bool(cur.fetchone()["ok"])
+    def health(self) -> Dict[str, bool]:
+        cur = self._cursor
+        cur.execute(
+            """
+            SELECT
+                1 AS ok,
+                EXISTS(SELECT 1 FROM pg_extension WHERE extname = 'postgis') AS postgis_ok,
+                EXISTS(SELECT 1 FROM pg_extension WHERE extname = 'pgrouting') AS pgrouting_ok
+            """,
+            prepare=True,
+        )
+        row = cur.fetchone()
 
         return {
-            "db_ok": db_ok,
-            "postgis_ok": postgis_ok,
-            "pgrouting_ok": pgrouting_ok,
+            "db_ok": row["ok"] == 1,
+            "postgis_ok": bool(row["postgis_ok"]),
+            "pgrouting_ok": bool(row["pgrouting_ok"]),
         }
 
     def system_summary(self) -> Dict[str, int]:
-        with self.conn.cursor() as cur:
-            cur.execute(
-                """
-                SELECT
-                    (SELECT COUNT(*) FROM districts) AS district_count,
-                    (SELECT COUNT(*) FROM franchise_zones) AS franchise_count,
-                    (SELECT COUNT(*) FROM fiber_nodes) AS fiber_node_count,
-                    (SELECT COUNT(*) FROM road_edges) AS road_edge_count,
-                    (SELECT COUNT(*) FROM road_nodes) AS road_node_count
-                """
-            )
-            row = cur.fetchone()
+        cur = self._cursor
+        cur.execute(
+            """
+            SELECT
+                (SELECT COUNT(*) FROM districts) AS district_count,
+                (SELECT COUNT(*) FROM franchise_zones) AS franchise_count,
+                (SELECT COUNT(*) FROM fiber_nodes) AS fiber_node_count,
+                (SELECT COUNT(*) FROM road_edges) AS road_edge_count,
+                (SELECT COUNT(*) FROM road_nodes) AS road_node_count
+            """,
+            prepare=True,
+        )
+        row = cur.fetchone()
         return row
 
     def list_districts(self) -> List[Dict]:
-        with self.conn.cursor() as cur:
-            cur.execute(
-                """
-                SELECT
-                    d.district_id,
-                    d.name,
-                    COUNT(f.franchise_id)::int AS franchise_count
-                FROM districts d
-                LEFT JOIN franchise_zones f ON d.district_id = f.district_id
-                GROUP BY d.district_id, d.name
-                ORDER BY d.name
-                """
-            )
-            return cur.fetchall()
+        cur = self._cursor
+        cur.execute(
+            """
+            SELECT
+                d.district_id,
+                d.name,
+                COUNT(f.franchise_id)::int AS franchise_count
+            FROM districts d
+            LEFT JOIN franchise_zones f ON d.district_id = f.district_id
+            GROUP BY d.district_id, d.name
+            ORDER BY d.name
+            """,
+            prepare=True,
+        )
+        return cur.fetchall()
 
     def list_franchises(self, district_id: Optional[str]) -> List[Dict]:
-        with self.conn.cursor() as cur:
-            if district_id:
-                cur.execute(
-                    """
-                    SELECT
-                        f.franchise_id,
-                        f.district_id,
-                        COUNT(n.node_id)::int AS node_count
-                    FROM franchise_zones f
-                    LEFT JOIN fiber_nodes n ON n.franchise_id = f.franchise_id
-                    WHERE f.district_id = %s
-                    GROUP BY f.franchise_id, f.district_id
-                    ORDER BY f.franchise_id
-                    """,
-                    (district_id,),
-                )
-            else:
-                cur.execute(
-                    """
-                    SELECT
-                        f.franchise_id,
-                        f.district_id,
-                        COUNT(n.node_id)::int AS node_count
-                    FROM franchise_zones f
-                    LEFT JOIN fiber_nodes n ON n.franchise_id = f.franchise_id
-                    GROUP BY f.franchise_id, f.district_id
-                    ORDER BY f.franchise_id
-                    """
-                )
-            return cur.fetchall()
-
-    def resolve_franchise(self, longitude: float, latitude: float) -> Optional[str]:
-        with self.conn.cursor() as cur:
+        cur = self._cursor
+        if district_id:
             cur.execute(
                 """
-                WITH consumer AS (
-                    SELECT ST_SetSRID(ST_Point(%s, %s), 4326) AS geom
-                )
-                SELECT f.franchise_id
+                SELECT
+                    f.franchise_id,
+                    f.district_id,
+                    COUNT(n.node_id)::int AS node_count
                 FROM franchise_zones f
-                CROSS JOIN consumer c
-                WHERE ST_Contains(f.geom, c.geom)
-                LIMIT 1
+                LEFT JOIN fiber_nodes n ON n.franchise_id = f.franchise_id
+                WHERE f.district_id = %s
+                GROUP BY f.franchise_id, f.district_id
+                ORDER BY f.franchise_id
                 """,
-                (longitude, latitude),
+                (district_id,),
+                prepare=True,
             )
-            row = cur.fetchone()
-        return row["franchise_id"] if row else None
-
-    def nearest_fiber_node(self, franchise_id: str, longitude: float, latitude: float) -> Optional[Dict]:
-        with self.conn.cursor() as cur:
+        else:
             cur.execute(
                 """
-                WITH consumer AS (
-                    SELECT ST_SetSRID(ST_Point(%s, %s), 4326) AS geom
-                )
                 SELECT
-                    fn.node_id,
-                    ST_Distance(fn.geom::geography, c.geom::geography) AS distance_meters
-                FROM fiber_nodes fn
-                CROSS JOIN consumer c
-                WHERE fn.franchise_id = %s
-                ORDER BY fn.geom <-> c.geom
-                LIMIT 1
+                    f.franchise_id,
+                    f.district_id,
+                    COUNT(n.node_id)::int AS node_count
+                FROM franchise_zones f
+                LEFT JOIN fiber_nodes n ON n.franchise_id = f.franchise_id
+                GROUP BY f.franchise_id, f.district_id
+                ORDER BY f.franchise_id
                 """,
-                (longitude, latitude, franchise_id),
+                prepare=True,
             )
-            return cur.fetchone()
+        return cur.fetchall()
 
-    def nearest_road_node(self, franchise_id: str, longitude: float, latitude: float) -> Optional[int]:
-        with self.conn.cursor() as cur:
-            cur.execute(
-                """
-                WITH p AS (
-                    SELECT ST_SetSRID(ST_Point(%s, %s), 4326) AS geom
-                )
-                SELECT rn.node_id
-                FROM road_nodes rn
-                CROSS JOIN p
-                WHERE rn.franchise_id = %s
-                ORDER BY rn.geom <-> p.geom
+    def _route_row(self, longitude: float, latitude: float, padding_degrees: float) -> Dict:
+        # Franchise, fiber node, both road snaps and the route itself are
+        # resolved in one round-trip; the outer LEFT JOINs keep a single row
+        # so the first NULL column tells which step failed. Dijkstra only sees
+        # edges inside the source/target bbox expanded by padding_degrees.
+        cur = self._cursor
+        cur.execute(
+            """
+            WITH consumer AS (
+                SELECT ST_SetSRID(ST_Point(%s, %s), 4326) AS geom
+            ),
+            franchise_match AS (
+                SELECT f.franchise_id
+                FROM franchise_zones_sub f
+                CROSS JOIN consumer c
+                WHERE f.geom && c.geom AND ST_Intersects(f.geom, c.geom)
                 LIMIT 1
-                """,
-                (longitude, latitude, franchise_id),
-            )
-            row = cur.fetchone()
-        return row["node_id"] if row else None
-
-    def fiber_node_coordinates(self, node_id: str) -> Optional[Dict]:
-        with self.conn.cursor() as cur:
-            cur.execute(
-                """
+            ),
+            fiber_match AS (
+                SELECT fn.node_id, fn.geom
+                FROM franchise_match fm
+                CROSS JOIN consumer c
+                CROSS JOIN LATERAL (
+                    SELECT node_id, geom
+                    FROM fiber_nodes
+                    WHERE franchise_id = fm.franchise_id
+                    ORDER BY geom <-> c.geom
+                    LIMIT 1
+                ) fn
+            ),
+            snap_src AS (
+                SELECT rn.node_id, rn.geom
+                FROM franchise_match fm
+                CROSS JOIN consumer c
+                CROSS JOIN LATERAL (
+                    SELECT node_id, geom
+                    FROM road_nodes
+                    WHERE franchise_id = fm.franchise_id
+                    ORDER BY geom <-> c.geom
+                    LIMIT 1
+                ) rn
+            ),
+            snap_tgt AS (
+                SELECT rn.node_id, rn.geom
+                FROM franchise_match fm
+                CROSS JOIN fiber_match fb
+                CROSS JOIN LATERAL (
+                    SELECT node_id, geom
+                    FROM road_nodes
+                    WHERE franchise_id = fm.franchise_id
+                    ORDER BY geom <-> fb.geom
+                    LIMIT 1
+                ) rn
+            ),
+            route AS (
+                SELECT r.*
+                FROM franchise_match fm
+                CROSS JOIN snap_src s
+                CROSS JOIN snap_tgt t
+                CROSS JOIN LATERAL pgr_dijkstra(
+                    format(
+                        'SELECT edge_id AS id, source, target, cost FROM road_edges '
+                        'WHERE franchise_id = %%L AND geom && ST_MakeEnvelope(%%s, %%s, %%s, %%s, 4326)',
+                        fm.franchise_id::text,
+                        LEAST(ST_X(s.geom), ST_X(t.geom)) - %s,
+                        LEAST(ST_Y(s.geom), ST_Y(t.geom)) - %s,
+                        GREATEST(ST_X(s.geom), ST_X(t.geom)) + %s,
+                        GREATEST(ST_Y(s.geom), ST_Y(t.geom)) + %s
+                    ),
+                    s.node_id,
+                    t.node_id,
+                    directed := false
+                ) r
+                WHERE s.node_id <> t.node_id
+            ),
+            route_agg AS (
                 SELECT
-                    ST_X(geom) AS longitude,
-                    ST_Y(geom) AS latitude
-                FROM fiber_nodes
-                WHERE node_id = %s
-                LIMIT 1
-                """,
-                (node_id,),
-            )
-            return cur.fetchone()
-
-    def road_node_coordinates(self, franchise_id: str, node_id: int) -> Optional[Dict]:
-        with self.conn.cursor() as cur:
-            cur.execute(
-                """
-                SELECT ST_X(geom) AS longitude, ST_Y(geom) AS latitude
-                FROM road_nodes
-                WHERE franchise_id = %s AND node_id = %s
-                LIMIT 1
-                """,
-                (franchise_id, node_id),
+                    COALESCE(SUM(e.length_m), 0) AS distance_meters,
+                    COUNT(*)::int AS edge_count,
+                    -- pgr_dijkstra emits edges in path order (seq) with r.node as the
+                    -- node each edge is entered from; flip edges walked target->source.
+                    ST_AsBinary(
+                        ST_MakeLine(
+                            array_agg(
+                                CASE WHEN e.source = r.node THEN e.geom ELSE ST_Reverse(e.geom) END
+                                ORDER BY r.seq
+                            )
+                        )
+                    ) AS route_wkb
+                FROM route r
+                JOIN road_edges e ON e.edge_id = r.edge
+                WHERE r.edge <> -1
             )
-            return cur.fetchone()
+            SELECT
+                fm.franchise_id,
+                fb.node_id AS nearest_node_id,
+                s.node_id AS source_road_node_id,
+                t.node_id AS target_road_node_id,
+                ST_X(s.geom) AS source_longitude,
+                ST_Y(s.geom) AS source_latitude,
+                ra.distance_meters,
+                ra.edge_count,
+                ra.route_wkb
+            FROM route_agg ra
+            LEFT JOIN franchise_match fm ON TRUE
+            LEFT JOIN fiber_match fb ON TRUE
+            LEFT JOIN snap_src s ON TRUE
+            LEFT JOIN snap_tgt t ON TRUE
+            """,
+            (longitude, latitude, *(padding_degrees,) * 4),
+            prepare=True,
+        )
+        return cur.fetchone()
 
     def compute_route(self, longitude: float, latitude: float) -> Dict:
-        franchise_id = self.resolve_franchise(longitude, latitude)
-        if not franchise_id:
-            raise AppError("outside_franchise", "Consumer point is outside configured franchise zones.", 400)
+        # Repeated consumer points are served from the lookup cache; failures
+        # raise AppError and are never cached.
+        key = ("route", _current_data_version(self._cursor), *_coord_key(longitude, latitude))
+        route = _cached(key, lambda: self._compute_route(longitude, latitude))
+        # Callers get their own dicts; the cached entry is shared across requests.
+        # Coordinates from mapping() are nested tuples, so two levels suffice.
+        return {**route, "route_geojson": dict(route["route_geojson"])}
 
-        nearest_node = self.nearest_fiber_node(franchise_id, longitude, latitude)
-        if not nearest_node:
-            raise AppError("no_fiber_node", "No fiber nodes available in resolved franchise.", 400)
+    def _compute_route(self, longitude: float, latitude: float) -> Dict:
+        # Start from a tight bbox and widen it only when no route fits inside;
+        # the last attempt covers the whole franchise graph.
+        padding = settings.route_bbox_padding_degrees
+        for padding_degrees in (padding, padding * 2, FULL_GRAPH_PADDING_DEGREES):
+            row = self._route_row(longitude, latitude, padding_degrees)
+            if row["edge_count"] or row["source_road_node_id"] is None or row["target_road_node_id"] is None:
+                break
+            if row["source_road_node_id"] == row["target_road_node_id"]:
+                break
 
-        fiber_coords = self.fiber_node_coordinates(nearest_node["node_id"])
-        if not fiber_coords:
-            raise AppError("fiber_node_geometry_missing", "Nearest fiber node geometry could not be resolved.", 500)
+        if row["franchise_id"] is None:
+            raise AppError("outside_franchise", "Consumer point is outside configured franchise zones.", 400)
+        if row["nearest_node_id"] is None:
+            raise AppError("no_fiber_node", "No fiber nodes available in resolved franchise.", 400)
 
-        source_road_node = self.nearest_road_node(franchise_id, longitude, latitude)
-        target_road_node = self.nearest_road_node(franchise_id, fiber_coords["longitude"], fiber_coords["latitude"])
+        source_road_node = row["source_road_node_id"]
+        target_road_node = row["target_road_node_id"]
         if source_road_node is None or target_road_node is None:
             raise AppError("road_snap_failed", "Road-node snapping failed for franchise subgraph.", 400)
 
         if source_road_node == target_road_node:
-            rn = self.road_node_coordinates(franchise_id, source_road_node)
-            if not rn:
-                raise AppError("road_snap_failed", "Road-node snapping failed for franchise subgraph.", 400)
-            line = {
-                "type": "LineString",
-                "coordinates": [[rn["longitude"], rn["latitude"]], [rn["longitude"], rn["latitude"]]],
-            }
+            point = (row["source_longitude"], row["source_latitude"])
             return {
-                "franchise_id": franchise_id,
-                "nearest_node_id": nearest_node["node_id"],
+                "franchise_id": row["franchise_id"],
+                "nearest_node_id": row["nearest_node_id"],
                 "source_road_node_id": source_road_node,
                 "target_road_node_id": target_road_node,
                 "distance_meters": 0.0,
                 "estimated_cost": 0.0,
                 "edge_count": 0,
-                "route_geojson": line,
+                "route_geojson": {"type": "LineString", "coordinates": (point, point)},
             }
 
-        with self.conn.cursor() as cur:
-            cur.execute(
-                """
-                WITH route AS (
-                    SELECT *
-                    FROM pgr_dijkstra(
-                        format(
-                            'SELECT edge_id AS id, source, target, cost FROM road_edges WHERE franchise_id = %%L',
-                            %s::text
-                        ),
-                        %s,
-                        %s,
-                        directed := false
-                    )
-                )
-                SELECT
-                    COALESCE(SUM(e.length_m), 0) AS distance_meters,
-                    COALESCE(SUM(e.cost), 0) AS deployment_cost,
-                    COUNT(*)::int AS edge_count,
-                    ST_AsGeoJSON(ST_LineMerge(ST_Collect(e.geom))) AS route_geojson
-                FROM route r
-                JOIN road_edges e ON e.edge_id = r.edge
-                WHERE r.edge <> -1
-                """,
-                (franchise_id, source_road_node, target_road_node),
-            )
-            route_row = cur.fetchone()
-
-        if not route_row or route_row["edge_count"] == 0 or not route_row["route_geojson"]:
+        if row["edge_count"] == 0 or not row["route_wkb"]:
             raise AppError("route_not_found", "No route could be computed inside the franchise road subgraph.", 400)
 
         return {
-            "franchise_id": franchise_id,
-            "nearest_node_id": nearest_node["node_id"],
+            "franchise_id": row["franchise_id"],
+            "nearest_node_id": row["nearest_node_id"],
             "source_road_node_id": source_road_node,
             "target_road_node_id": target_road_node,
-            "distance_meters": float(route_row["distance_meters"]),
-            "estimated_cost": float(route_row["deployment_cost"] or (route_row["distance_meters"] * settings.default_cost_per_meter)),
-            "edge_count": route_row["edge_count"],
-            "route_geojson": json.loads(route_row["route_geojson"]),
+            "distance_meters": float(row["distance_meters"]),
+            "estimated_cost": round(float(row["distance_meters"]) * settings.default_cost_per_meter, 2),
+            "edge_count": row["edge_count"],
+            "route_geojson": mapping(shapely.from_wkb(row["route_wkb"])),
         }
 
-    def _resolve_chunk(self, points_chunk: List[Dict]) -> List[Dict]:
+    def _resolve_chunk(self, points_chunk: Sequence[CoordinateInput], start_index: int = 0) -> List[Dict]:
+        # The whole response body is built in memory anyway, so the chunk is
+        # fetched in one round-trip rather than through a server-side cursor.
         with self.conn.cursor() as cur:
             cur.execute(
                 """
                 WITH input_points AS (
                     SELECT *
-                    FROM jsonb_to_recordset(%s::jsonb)
-                    AS t(input_index int, input_id text, latitude double precision, longitude double precision)
+                    FROM UNNEST(%s::int[], %s::text[], %s::float8[], %s::float8[])
+                    AS t(input_index, input_id, latitude, longitude)
                 ),
                 points AS (
                     SELECT
@@ -280,24 +354,21 @@ class PlanningService:
                     FROM points p
                     LEFT JOIN LATERAL (
                         SELECT franchise_id
-                        FROM franchise_zones
-                        WHERE ST_Contains(geom, p.geom)
+                        FROM franchise_zones_sub
+                        WHERE geom && p.geom AND ST_Intersects(geom, p.geom)
                         LIMIT 1
                     ) f ON TRUE
                 ),
                 fiber_match AS (
-                    SELECT
+                    -- Fiber nodes are sparse per franchise, so one set-based
+                    -- join + DISTINCT ON beats a KNN index descent per point.
+                    SELECT DISTINCT ON (fm.input_index)
                         fm.*,
                         fn.node_id AS nearest_node_id,
                         fn.geom AS nearest_node_geom
                     FROM franchise_match fm
-                    LEFT JOIN LATERAL (
-                        SELECT node_id, geom
-                        FROM fiber_nodes
-                        WHERE franchise_id = fm.franchise_id
-                        ORDER BY geom <-> fm.geom
-                        LIMIT 1
-                    ) fn ON fm.franchise_id IS NOT NULL
+                    LEFT JOIN fiber_nodes fn ON fn.franchise_id = fm.franchise_id
+                    ORDER BY fm.input_index, fn.geom <-> fm.geom
                 ),
                 snap_match AS (
                     SELECT
@@ -331,126 +402,114 @@ class PlanningService:
                       AND source_road_node_id IS NOT NULL
                       AND target_road_node_id IS NOT NULL
                 ),
+                per_franchise AS (
+                    SELECT
+                        franchise_id,
+                        array_agg(DISTINCT source_road_node_id) AS source_ids,
+                        array_agg(DISTINCT target_road_node_id) AS target_ids
+                    FROM valid_pairs
+                    GROUP BY franchise_id
+                ),
                 pair_costs AS (
+                    -- One many-to-many call per franchise: the franchise graph is
+                    -- built once and each source is expanded once for all targets.
                     SELECT
-                        vp.franchise_id,
-                        vp.source_road_node_id,
-                        vp.target_road_node_id,
+                        pf.franchise_id,
+                        pc.start_vid AS source_road_node_id,
+                        pc.end_vid AS target_road_node_id,
                         pc.agg_cost AS distance_meters
-                    FROM valid_pairs vp
-                    LEFT JOIN LATERAL (
-                        SELECT agg_cost
-                        FROM pgr_dijkstraCost(
-                            format(
-                                'SELECT edge_id AS id, source, target, cost FROM road_edges WHERE franchise_id = %%L',
-                                vp.franchise_id::text
-                            ),
-                            vp.source_road_node_id,
-                            vp.target_road_node_id,
-                            directed := false
-                        )
-                        LIMIT 1
-                    ) pc ON TRUE
+                    FROM per_franchise pf
+                    CROSS JOIN LATERAL pgr_dijkstraCost(
+                        format(
+                            'SELECT edge_id AS id, source, target, cost FROM road_edges WHERE franchise_id = %%L',
+                            pf.franchise_id::text
+                        ),
+                        pf.source_ids,
+                        pf.target_ids,
+                        directed := false
+                    ) pc
+                ),
+                resolved AS (
+                    SELECT
+                        sm.input_index,
+                        sm.input_id,
+                        sm.latitude,
+                        sm.longitude,
+                        sm.franchise_id,
+                        sm.nearest_node_id,
+                        sm.source_road_node_id,
+                        sm.target_road_node_id,
+                        CASE
+                            WHEN sm.source_road_node_id = sm.target_road_node_id THEN 0
+                            ELSE pair_costs.distance_meters
+                        END AS distance_meters,
+                        CASE
+                            WHEN sm.franchise_id IS NULL THEN 'outside_franchise'
+                            WHEN sm.nearest_node_id IS NULL THEN 'no_fiber_node'
+                            WHEN sm.source_road_node_id IS NULL OR sm.target_road_node_id IS NULL THEN 'road_snap_failed'
+                            WHEN sm.source_road_node_id = sm.target_road_node_id THEN NULL
+                            WHEN pair_costs.distance_meters IS NULL THEN 'route_not_found'
+                            ELSE NULL
+                        END AS error_code
+                    FROM snap_match sm
+                    LEFT JOIN pair_costs
+                      ON pair_costs.franchise_id = sm.franchise_id
+                     AND pair_costs.source_road_node_id = sm.source_road_node_id
+                     AND pair_costs.target_road_node_id = sm.target_road_node_id
                 )
                 SELECT
-                    sm.input_index,
-                    sm.input_id,
-                    sm.latitude,
-                    sm.longitude,
-                    sm.franchise_id,
-                    sm.nearest_node_id,
-                    sm.source_road_node_id,
-                    sm.target_road_node_id,
-                    CASE
-                        WHEN sm.source_road_node_id = sm.target_road_node_id THEN 0
-                        ELSE pair_costs.distance_meters
-                    END AS distance_meters,
+                    input_index,
+                    input_id,
+                    latitude,
+                    longitude,
+                    CASE WHEN error_code IS NULL THEN 'ok' ELSE 'error' END AS status,
+                    franchise_id,
+                    nearest_node_id,
+                    source_road_node_id,
+                    target_road_node_id,
+                    CASE WHEN error_code IS NULL THEN distance_meters END AS distance_meters,
                     CASE
-                        WHEN sm.franchise_id IS NULL THEN 'outside_franchise'
-                        WHEN sm.nearest_node_id IS NULL THEN 'no_fiber_node'
-                        WHEN sm.source_road_node_id IS NULL OR sm.target_road_node_id IS NULL THEN 'road_snap_failed'
-                        WHEN sm.source_road_node_id = sm.target_road_node_id THEN NULL
-                        WHEN pair_costs.distance_meters IS NULL THEN 'route_not_found'
-                        ELSE NULL
-                    END AS error_code
-                FROM snap_match sm
-                LEFT JOIN pair_costs
-                  ON pair_costs.franchise_id = sm.franchise_id
-                 AND pair_costs.source_road_node_id = sm.source_road_node_id
-                 AND pair_costs.target_road_node_id = sm.target_road_node_id
-                ORDER BY sm.input_index
+                        WHEN error_code IS NULL THEN ROUND((distance_meters * %s)::numeric, 2)::float8
+                    END AS estimated_cost,
+                    NULL::int AS edge_count,
+                    NULL::json AS route_geojson,
+                    error_code,
+                    replace(error_code, '_', ' ') AS error_message
+                FROM resolved
+                ORDER BY input_index
                 """,
-                (json.dumps(points_chunk),),
+                (
+                    list(range(start_index, start_index + len(points_chunk))),
+                    [p.id for p in points_chunk],
+                    [p.latitude for p in points_chunk],
+                    [p.longitude for p in points_chunk],
+                    settings.default_cost_per_meter,
+                ),
             )
-            rows = cur.fetchall()
-        return rows
+            return cur.fetchall()
 
-    def compute_batch(self, coordinates: List[Dict], include_geometry: bool = False) -> Dict:
+    def compute_batch(self, coordinates: Sequence[CoordinateInput], include_geometry: bool = False) -> Dict:
         if include_geometry:
             raise AppError("unsupported_option", "Geometry output is disabled for batch mode.", 400)
+        if not coordinates:
+            return {"total": 0, "success_count": 0, "failed_count": 0, "results": []}
 
-        all_rows: List[Dict] = []
+        # Chunks are slices of the decoded structs; the UNNEST columns are read
+        # straight off their attributes, so no per-point dict is ever built.
         chunk_size = max(1, settings.batch_chunk_size)
+        starts = range(0, len(coordinates), chunk_size)
+        chunks = [coordinates[start : start + chunk_size] for start in starts]
 
-        for start in range(0, len(coordinates), chunk_size):
-            chunk = coordinates[start : start + chunk_size]
-            chunk_payload = [
-                {
-                    "input_index": start + idx,
-                    "input_id": item.get("id"),
-                    "latitude": item["latitude"],
-                    "longitude": item["longitude"],
-                }
-                for idx, item in enumerate(chunk)
-            ]
-            all_rows.extend(self._resolve_chunk(chunk_payload))
-
-        results = []
-        success_count = 0
-
-        for row in all_rows:
-            if row["error_code"] is None:
-                success_count += 1
-                distance_meters = float(row["distance_meters"])
-                results.append(
-                    {
-                        "input_index": row["input_index"],
-                        "input_id": row["input_id"],
-                        "latitude": row["latitude"],
-                        "longitude": row["longitude"],
-                        "status": "ok",
-                        "franchise_id": row["franchise_id"],
-                        "nearest_node_id": row["nearest_node_id"],
-                        "source_road_node_id": row["source_road_node_id"],
-                        "target_road_node_id": row["target_road_node_id"],
-                        "distance_meters": distance_meters,
-                        "estimated_cost": round(distance_meters * settings.default_cost_per_meter, 2),
-                        "edge_count": None,
-                        "route_geojson": None,
-                        "error_code": None,
-                        "error_message": None,
-                    }
-                )
-            else:
-                results.append(
-                    {
-                        "input_index": row["input_index"],
-                        "input_id": row["input_id"],
-                        "latitude": row["latitude"],
-                        "longitude": row["longitude"],
-                        "status": "error",
-                        "franchise_id": row["franchise_id"],
-                        "nearest_node_id": row["nearest_node_id"],
-                        "source_road_node_id": row["source_road_node_id"],
-                        "target_road_node_id": row["target_road_node_id"],
-                        "distance_meters": None,
-                        "estimated_cost": None,
-                        "edge_count": None,
-                        "route_geojson": None,
-                        "error_code": row["error_code"],
-                        "error_message": row["error_code"].replace("_", " "),
-                    }
-                )
+        if len(chunks) == 1:
+            results = self._resolve_chunk(chunks[0])
+        else:
+            # Chunks run concurrently, each on its own pooled connection;
+            # map() keeps results in input order.
+            results = list(chain.from_iterable(BATCH_ROUTE_EXECUTOR.map(_resolve_chunk_pooled, chunks, starts)))
+
+        # Rows already arrive in BatchRouteItem shape; status, cost and error
+        # message are derived column-wise in the final SELECT.
+        success_count = sum(1 for row in results if row["error_code"] is None)
 
         failed_count = len(results) - success_count
         return {
@@ -459,3 +518,8 @@ class PlanningService:
             "failed_count": failed_count,
             "results": results,
         }
+
+
+def _resolve_chunk_pooled(points_chunk: Sequence[CoordinateInput], start_index: int) -> List[Dict]:
+    with get_db() as conn:
+        return PlanningService(conn)._resolve_chunk(points_chunk, start_index)
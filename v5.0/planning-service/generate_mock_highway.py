@@ -1,6 +1,6 @@
 import json
-import math
-import random
+
+import numpy as np
 
 roads = {
     'type': 'FeatureCollection',
@@ -33,23 +33,22 @@ except FileNotFoundError:
 # Sort them North to South
 infras.sort(key=lambda x: x['lat'], reverse=True)
 
-# Generate dense points along this route to act as our road nodes
-coords = []
-for i in range(len(infras) - 1):
-    curr = infras[i]
-    nxt = infras[i+1]
-    
-    # Generate 50 points between each infra node
-    num_points = 50
-    for j in range(num_points):
-        frac = j / num_points
-        lat = curr['lat'] + (nxt['lat'] - curr['lat']) * frac
-        # add a small wiggle to make it look like a road segment
-        lng = curr['lng'] + (nxt['lng'] - curr['lng']) * frac + (math.sin(j) * 0.001)
-        coords.append([round(lng, 6), round(lat, 6)])
+infra_lats = np.array([infra['lat'] for infra in infras], dtype=float)
+infra_lngs = np.array([infra['lng'] for infra in infras], dtype=float)
 
+# Generate dense points along this route to act as our road nodes:
+# 50 points between each consecutive pair of infra nodes, computed for
+# every pair at once (rows are pairs, columns are steps).
+num_points = 50
+steps = np.arange(num_points)
+frac = steps / num_points
+lats = infra_lats[:-1, None] + (infra_lats[1:] - infra_lats[:-1])[:, None] * frac
+# add a small wiggle to make it look like a road segment
+lngs = infra_lngs[:-1, None] + (infra_lngs[1:] - infra_lngs[:-1])[:, None] * frac + np.sin(steps) * 0.001
 # add the final node
-coords.append([round(infras[-1]['lng'], 6), round(infras[-1]['lat'], 6)])
+lats = np.append(lats.ravel(), infra_lats[-1])
+lngs = np.append(lngs.ravel(), infra_lngs[-1])
+coords = np.stack([lngs.round(6), lats.round(6)], axis=1).tolist()
 
 roads['features'].append({
     'type': 'Feature',
@@ -61,18 +60,13 @@ roads['features'].append({
 })
 
 # Let's add cross-roads for graph diversity
-for infra in infras[::3]:  # Every 3rd infra point gets a crossroad
-    cross_coords = []
-    base_lat = infra['lat']
-    base_lng = infra['lng']
-    
-    # West to East
-    for j in range(-20, 21):
-        if j == 0: continue
-        lat = base_lat + random.uniform(-0.005, 0.005)
-        lng = base_lng + (j * 0.0015)
-        cross_coords.append([round(lng, 6), round(lat, 6)])
-        
+rng = np.random.default_rng()
+offsets = np.concatenate([np.arange(-20, 0), np.arange(1, 21)]) * 0.0015  # West to East, skipping the centre
+crossing = infras[::3]  # Every 3rd infra point gets a crossroad
+cross_lats = infra_lats[::3, None] + rng.uniform(-0.005, 0.005, size=(len(crossing), offsets.size))
+cross_lngs = np.broadcast_to(infra_lngs[::3, None] + offsets, cross_lats.shape)
+for infra, lat_row, lng_row in zip(crossing, cross_lats, cross_lngs):
+    cross_coords = np.stack([lng_row.round(6), lat_row.round(6)], axis=1).tolist()
     roads['features'].append({
         'type': 'Feature',
         'properties': {'name': f"Crossroad near {infra['id']}"},
@@ -0,0 +1,32 @@
+import multiprocessing
+import os
+import subprocess
+import sys
+
+# Production launch: `gunicorn main:app -c gunicorn.conf.py`.
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8000")
+# One worker per core: request handlers mostly wait on PostgreSQL from
+# threads, so extra processes add connections rather than throughput.
+workers = int(os.getenv("GUNICORN_WORKERS", multiprocessing.cpu_count()))
+worker_class = "uvicorn_worker.UvicornWorker"
+worker_connections = 1000
+keepalive = 5
+graceful_timeout = 30
+# No per-request access log; ServiceMiddleware logs failed and slow requests.
+accesslog = None
+
+# Keep preload_app off: each worker imports the app after fork, so its
+# executors, DB pool and background threads are its own.
+preload_app = False
+
+# Workers inherit these: they skip the startup schema/recovery step, which the
+# master runs once below, and split DB_MAX_CONNECTIONS and the per-process
+# caps by the worker count. Jobs of a worker that dies later are failed by the
+# surviving workers' heartbeat threads.
+os.environ["RUN_STARTUP_RECOVERY"] = "false"
+os.environ["WEB_CONCURRENCY"] = str(workers)
+
+
+def on_starting(server):
+    # Separate process so no pool or thread is created in the master.
+    subprocess.run([sys.executable, "-m", "app.bootstrap"], check=True)
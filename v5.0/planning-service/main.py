@@ -1,18 +1,25 @@
+import asyncio
 import uvicorn
 import logging
+import orjson
+from contextlib import asynccontextmanager
+from cachetools import TTLCache
 from fastapi import FastAPI
 from fastapi.exceptions import RequestValidationError
 from fastapi import HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.requests import Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse, Response
 
+from app.bootstrap import recover_incomplete_jobs, upgrade_planning_tables
 from app.config import settings
+from app.db import close_pool, open_pool
 from app.executor_pool import shutdown_executors
 from app.errors import AppError
-from app.job_repository import job_repository
+from app.job_repository import chunk_result_writer, job_repository, worker_heartbeat
+from app.job_store import job_store
 from app.logging_setup import configure_logging
-from app.middleware import InMemoryRateLimitMiddleware, PayloadSizeLimitMiddleware, RequestContextMiddleware, RequestTimeoutMiddleware
+from app.middleware import ServiceMiddleware
 from app.routers.catalog import router as catalog_router
 from app.routers.health import router as health_router
 from app.routers.routing import router as routing_router
@@ -21,52 +28,115 @@ from app.routers.upload_batch import router as upload_batch_router
 configure_logging()
 logger = logging.getLogger("planning-service")
 
+TRACEBACK_LOG_INTERVAL_SECONDS = 60
+
+
+def _stop_background_work() -> None:
+    job_store.stop_janitor()
+    shutdown_executors()
+    worker_heartbeat.stop()
+    chunk_result_writer.stop()
+    close_pool()
+
+
+def _log_recovery_failure(task: asyncio.Task) -> None:
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("job_recovery_failed", exc_info=task.exception())
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await asyncio.to_thread(open_pool)
+    # Under Gunicorn the master has already done this once for all workers.
+    # The schema must exist before serving; the recovery scan only touches
+    # jobs older than itself, so it runs in the background while the app
+    # already answers requests.
+    recovery = None
+    if settings.run_startup_recovery:
+        await asyncio.to_thread(upgrade_planning_tables)
+        await asyncio.to_thread(job_repository.ensure_schema)
+        recovery = asyncio.create_task(asyncio.to_thread(recover_incomplete_jobs))
+        recovery.add_done_callback(_log_recovery_failure)
+    await asyncio.to_thread(worker_heartbeat.start)
+    chunk_result_writer.start()
+    job_store.start_janitor(settings.job_cleanup_interval_seconds)
+    # Build the OpenAPI schema now; FastAPI caches it on app.openapi_schema,
+    # so /openapi.json and /docs never pay for it on a request.
+    app.openapi()
+    try:
+        yield
+    finally:
+        if recovery is not None:
+            # Let the scan finish before its pool goes away.
+            await asyncio.gather(recovery, return_exceptions=True)
+        # Joins worker threads; keep the loop free while in-flight requests drain.
+        await asyncio.to_thread(_stop_background_work)
+
+
 app = FastAPI(
     title=settings.app_name,
     description=settings.app_description,
     version=settings.app_version,
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan,
 )
 
-origins = [origin.strip() for origin in settings.cors_allow_origins.split(",") if origin.strip()]
+# Explicit methods/headers (the routers only serve GET and JSON POST) let
+# preflight checks match by set membership instead of the wildcard branch.
+CORS_ORIGINS = tuple(origin.strip() for origin in settings.cors_allow_origins.split(",") if origin.strip()) or ("*",)
+CORS_METHODS = ("GET", "POST")
+CORS_HEADERS = ("authorization", "content-type", "x-request-id")
+
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=origins or ["*"],
+    allow_origins=CORS_ORIGINS,
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=CORS_METHODS,
+    allow_headers=CORS_HEADERS,
 )
-app.add_middleware(RequestContextMiddleware)
-app.add_middleware(PayloadSizeLimitMiddleware)
-app.add_middleware(InMemoryRateLimitMiddleware)
-app.add_middleware(RequestTimeoutMiddleware)
+app.add_middleware(ServiceMiddleware)
 
 
 @app.exception_handler(AppError)
 async def app_error_handler(request: Request, exc: AppError):
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=exc.status_code,
         content={
             "error": {"code": exc.code, "message": exc.message},
-            "request_id": getattr(request.state, "request_id", None),
+            "request_id": request.state.request_id,
         },
     )
 
 
+def _json_response(status_code: int, body: bytes) -> Response:
+    return Response(content=body, status_code=status_code, media_type="application/json")
+
+
+def _envelope_prefix(code: str, message: str) -> bytes:
+    # '{"error":{"code":...,"message":...' left open for the variable fields.
+    return b'{"error":' + orjson.dumps({"code": code, "message": message})[:-1]
+
+
+# Envelope fronts serialized once; per response only the details and the
+# request id (client-supplied, so still JSON-encoded) are encoded.
+_MALFORMED_JSON_PREFIX = _envelope_prefix("malformed_json", "Malformed JSON request body.") + b',"details":'
+_VALIDATION_ERROR_PREFIX = _envelope_prefix("validation_error", "Request payload validation failed.") + b',"details":'
+_INTERNAL_ERROR_PREFIX = _envelope_prefix("internal_error", "An internal server error occurred.") + b'},"request_id":'
+# Pydantic echoes the offending input (possibly a whole batch body) and a docs
+# URL into each error; neither is useful to API clients.
+_OMITTED_ERROR_KEYS = frozenset(("input", "url"))
+
+
 @app.exception_handler(RequestValidationError)
 async def validation_error_handler(request: Request, exc: RequestValidationError):
-    details = exc.errors()
-    malformed_json = any(err.get("type") == "json_invalid" for err in details)
-    return JSONResponse(
-        status_code=422,
-        content={
-            "error": {
-                "code": "malformed_json" if malformed_json else "validation_error",
-                "message": "Malformed JSON request body." if malformed_json else "Request payload validation failed.",
-                "details": details,
-            },
-            "request_id": getattr(request.state, "request_id", None),
-        },
-    )
+    prefix = _VALIDATION_ERROR_PREFIX
+    details = []
+    for err in exc.errors():
+        if err.get("type") == "json_invalid":
+            prefix = _MALFORMED_JSON_PREFIX
+        details.append({key: value for key, value in err.items() if key not in _OMITTED_ERROR_KEYS})
+    body = prefix + orjson.dumps(details) + b'},"request_id":' + orjson.dumps(request.state.request_id) + b"}"
+    return _json_response(422, body)
 
 
 @app.exception_handler(HTTPException)
@@ -76,54 +146,61 @@ async def http_exception_handler(request: Request, exc: HTTPException):
         error = detail
     else:
         error = {"code": "http_error", "message": str(detail)}
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=exc.status_code,
         content={
             "error": error,
-            "request_id": getattr(request.state, "request_id", None),
+            "request_id": request.state.request_id,
         },
     )
 
 
+# Only touched from exception handlers on the event loop, so no lock.
+_recent_tracebacks: TTLCache = TTLCache(maxsize=1024, ttl=TRACEBACK_LOG_INTERVAL_SECONDS)
+
+
 @app.exception_handler(Exception)
 async def unhandled_error_handler(request: Request, exc: Exception):
-    logger.exception(
+    path = request.scope["path"]
+    # A full traceback once per (exception type, path) per interval; repeats
+    # in between are logged without one so an error storm cannot amplify.
+    traceback_key = (type(exc), path)
+    with_traceback = traceback_key not in _recent_tracebacks
+    if with_traceback:
+        _recent_tracebacks[traceback_key] = True
+    logger.error(
         "unhandled_exception",
+        exc_info=exc if with_traceback else None,
         extra={
-            "request_id": getattr(request.state, "request_id", None),
-            "path": request.url.path,
+            "request_id": request.state.request_id,
+            "path": path,
             "method": request.method,
         },
     )
-    return JSONResponse(
-        status_code=500,
-        content={
-            "error": {"code": "internal_error", "message": "An internal server error occurred."},
-            "request_id": getattr(request.state, "request_id", None),
-        },
-    )
+    return _json_response(500, _INTERNAL_ERROR_PREFIX + orjson.dumps(request.state.request_id) + b"}")
 
-app.include_router(health_router)
+# Health probes are for orchestrators, not API clients; keep them out of the docs.
+app.include_router(health_router, include_in_schema=False)
 app.include_router(catalog_router)
 app.include_router(routing_router)
 app.include_router(upload_batch_router)
 
 
-@app.on_event("startup")
-def startup_event():
-    job_repository.ensure_schema()
-    recovered = job_repository.mark_incomplete_jobs_failed()
-    if recovered:
-        logger.warning(
-            "recovered_incomplete_jobs",
-            extra={"recovered_jobs": recovered},
-        )
-
-
-@app.on_event("shutdown")
-def shutdown_event():
-    shutdown_executors()
-
-
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+    # uvloop + httptools instead of the asyncio loop and pure-Python h11
+    # parser; Server/Date headers and access-log lines are not formatted on
+    # every response.
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="uvloop",
+        http="httptools",
+        reload=False,
+        proxy_headers=True,
+        server_header=False,
+        date_header=False,
+        # ServiceMiddleware logs failed and slow requests as JSON instead.
+        access_log=False,
+        log_level="warning",
+    )
@@ -1,9 +1,16 @@
+import argparse
+import hashlib
 import json
+import os
 from collections import defaultdict
 from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional
 
-from shapely.geometry import MultiPoint, Point, shape
+import ijson
+import shapely
+from shapely.geometry import MultiPoint, Point, mapping, shape
 from shapely.ops import unary_union, voronoi_diagram
+from shapely.strtree import STRtree
 
 
 ROOT = Path(__file__).resolve().parents[2]
@@ -19,68 +26,119 @@ FRANCHISE_ZONES_OUT = DATA_DIR / "franchise_zones.geojson"
 FIBER_NODES_OUT = DATA_DIR / "fiber_nodes.geojson"
 ROADS_OUT = DATA_DIR / "roads.geojson"
 
+MANIFEST_PATH = DATA_DIR / ".manifest.json"
 
-def read_geojson(path: Path) -> dict:
-    with path.open("r", encoding="utf-8") as f:
-        return json.load(f)
 
+def load_manifest() -> Dict[str, dict]:
+    try:
+        return json.loads(MANIFEST_PATH.read_text(encoding="utf-8"))
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
 
-def write_geojson(path: Path, payload: dict) -> None:
-    path.write_text(json.dumps(payload, indent=2), encoding="utf-8")
 
+def save_manifest(manifest: Dict[str, dict]) -> None:
+    tmp_path = MANIFEST_PATH.with_name(MANIFEST_PATH.name + ".tmp")
+    tmp_path.write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+    os.replace(tmp_path, MANIFEST_PATH)
 
-def normalize_districts(src: dict) -> dict:
-    features = []
-    for feat in src.get("features", []):
+
+def fingerprint(path: Path, previous: Optional[dict]) -> dict:
+    stat = path.stat()
+    # Unchanged mtime and size: reuse the recorded hash instead of re-reading the file.
+    if previous and previous.get("mtime_ns") == stat.st_mtime_ns and previous.get("size") == stat.st_size:
+        return previous
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "sha256": digest.hexdigest()[:16]}
+
+
+def stage_inputs(manifest: Dict[str, dict], output: Path, sources: List[Path]) -> Dict[str, dict]:
+    previous = manifest.get(str(output), {})
+    return {str(src): fingerprint(src, previous.get(str(src))) for src in sources}
+
+
+def stage_is_current(manifest: Dict[str, dict], output: Path, inputs: Dict[str, dict]) -> bool:
+    previous = manifest.get(str(output))
+    if not previous or not output.exists() or previous.keys() != inputs.keys():
+        return False
+    return all(previous[src]["sha256"] == fp["sha256"] for src, fp in inputs.items())
+
+
+def iter_features(path: Path) -> Iterator[dict]:
+    # Stream features one at a time; source files can be hundreds of MB.
+    with path.open("rb") as f:
+        yield from ijson.items(f, "features.item", use_float=True)
+
+
+def write_geojson(path: Path, features: Iterable[dict]) -> int:
+    # Write beside the target and swap it in, so an interrupted run never
+    # leaves a truncated output that a later run could mistake for current.
+    tmp_path = path.with_name(path.name + ".tmp")
+    count = 0
+    try:
+        with tmp_path.open("w", encoding="utf-8") as f:
+            f.write('{"type": "FeatureCollection", "features": [\n')
+            for feat in features:
+                if count:
+                    f.write(",\n")
+                f.write(json.dumps(feat))
+                count += 1
+            f.write("\n]}\n")
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    return count
+
+
+def normalize_districts(features: Iterable[dict]) -> Iterator[dict]:
+    for feat in features:
         props = feat.get("properties", {})
         district_id = props.get("district_id") or props.get("GID_2") or props.get("id")
         name = props.get("name") or props.get("NAME_2") or district_id
-        features.append(
-            {
-                "type": "Feature",
-                "properties": {
-                    "district_id": district_id,
-                    "name": name,
-                },
-                "geometry": feat.get("geometry"),
-            }
-        )
-    return {"type": "FeatureCollection", "features": features}
-
-
-def normalize_fiber_nodes(src: dict) -> dict:
-    features = []
-    for feat in src.get("features", []):
+        yield {
+            "type": "Feature",
+            "properties": {
+                "district_id": district_id,
+                "name": name,
+            },
+            "geometry": feat.get("geometry"),
+        }
+
+
+def normalize_fiber_nodes(features: Iterable[dict]) -> Iterator[dict]:
+    for feat in features:
         props = feat.get("properties", {})
         node_id = props.get("node_id") or props.get("id") or props.get("infra_id")
         franchise_id = props.get("franchise_id")
         if not node_id or not franchise_id:
             continue
-        features.append(
-            {
-                "type": "Feature",
-                "properties": {
-                    "node_id": node_id,
-                    "franchise_id": franchise_id,
-                    "capacity": props.get("capacity", 1000),
-                    "status": props.get("status", "active"),
-                },
-                "geometry": feat.get("geometry"),
-            }
-        )
-    return {"type": "FeatureCollection", "features": features}
-
-
-def build_franchise_zones(districts: dict, franchise_points: dict, fiber_nodes: dict) -> dict:
+        yield {
+            "type": "Feature",
+            "properties": {
+                "node_id": node_id,
+                "franchise_id": franchise_id,
+                "capacity": props.get("capacity", 1000),
+                "status": props.get("status", "active"),
+            },
+            "geometry": feat.get("geometry"),
+        }
+
+
+def build_franchise_zones(
+    districts: List[dict], franchise_points: Iterable[dict], fiber_nodes: List[dict]
+) -> List[dict]:
     district_geoms = {}
-    for feat in districts.get("features", []):
+    for feat in districts:
         district_id = feat.get("properties", {}).get("district_id")
         if not district_id:
             continue
         district_geoms[district_id] = shape(feat.get("geometry"))
 
     district_points = defaultdict(list)
-    for feat in franchise_points.get("features", []):
+    for feat in franchise_points:
         props = feat.get("properties", {})
         district_id = props.get("district_id") or props.get("GID_2")
         if district_id not in district_geoms:
@@ -101,7 +159,7 @@ def build_franchise_zones(districts: dict, franchise_points: dict, fiber_nodes:
         district_points[district_id].append((franchise_id, point))
 
     assigned = defaultdict(list)
-    for feat in fiber_nodes.get("features", []):
+    for feat in fiber_nodes:
         props = feat.get("properties", {})
         fid = props.get("franchise_id")
         nid = props.get("node_id")
@@ -128,7 +186,7 @@ def build_franchise_zones(districts: dict, franchise_points: dict, fiber_nodes:
                         "district_id": district_id,
                         "assigned_node_ids": sorted(assigned.get(fid, [])),
                     },
-                    "geometry": json.loads(json.dumps(poly.__geo_interface__)),
+                    "geometry": mapping(poly),
                 }
             )
             continue
@@ -136,23 +194,25 @@ def build_franchise_zones(districts: dict, franchise_points: dict, fiber_nodes:
         multi = MultiPoint([p for _, p in points])
         vor = voronoi_diagram(multi, envelope=dgeom.envelope, edges=False)
         cells = [g for g in vor.geoms if not g.is_empty]
+        cell_tree = STRtree(cells)
+        # Clip every cell to the district in one vectorized call.
+        clipped_cells = shapely.intersection(cells, dgeom)
 
-        used = set()
+        used_cells = set()
         for fid, pt in points:
-            # choose the cell that contains the point; fallback to nearest by centroid.
-            cell = next((c for c in cells if c.contains(pt) or c.touches(pt)), None)
-            if cell is None:
-                cell = min(cells, key=lambda c: c.centroid.distance(pt))
+            # choose the cell that contains (or touches) the point; fallback to the nearest cell.
+            hits = cell_tree.query(pt, predicate="intersects")
+            cell_idx = int(hits.min()) if len(hits) else int(cell_tree.nearest(pt))
 
-            clipped = cell.intersection(dgeom)
-            if clipped.is_empty:
+            # Avoid duplicate assignment of the same cell; Voronoi cells are
+            # disjoint, so the cell index identifies the clipped geometry.
+            if cell_idx in used_cells:
                 continue
 
-            # Avoid duplicate assignment of identical geometry object.
-            key = clipped.wkt
-            if key in used:
+            clipped = clipped_cells[cell_idx]
+            if clipped.is_empty:
                 continue
-            used.add(key)
+            used_cells.add(cell_idx)
 
             out_features.append(
                 {
@@ -162,50 +222,78 @@ def build_franchise_zones(districts: dict, franchise_points: dict, fiber_nodes:
                         "district_id": district_id,
                         "assigned_node_ids": sorted(assigned.get(fid, [])),
                     },
-                    "geometry": json.loads(json.dumps(clipped.__geo_interface__)),
+                    "geometry": mapping(clipped),
                 }
             )
 
-    return {"type": "FeatureCollection", "features": out_features}
+    return out_features
 
 
-def normalize_roads(src: dict) -> dict:
+def normalize_roads(features: Iterable[dict]) -> Iterator[dict]:
     # Keep as-is; ingestion now supports LineString and MultiLineString.
-    clean_features = []
-    for feat in src.get("features", []):
+    for feat in features:
         geom = feat.get("geometry", {})
         if geom.get("type") not in {"LineString", "MultiLineString"}:
             continue
-        clean_features.append(
-            {
-                "type": "Feature",
-                "properties": feat.get("properties", {}),
-                "geometry": geom,
-            }
-        )
-    return {"type": "FeatureCollection", "features": clean_features}
+        yield {
+            "type": "Feature",
+            "properties": feat.get("properties", {}),
+            "geometry": geom,
+        }
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Normalize uploaded GeoJSON into planning-service data files.")
+    parser.add_argument("--force", action="store_true", help="Rebuild every output even if its inputs are unchanged")
+    return parser.parse_args()
 
 
 def main() -> None:
-    districts_raw = read_geojson(DISTRICTS_SRC)
-    franchise_points_raw = read_geojson(FRANCHISE_POINTS_SRC)
-    fiber_nodes_raw = read_geojson(FIBER_NODES_SRC)
-    roads_raw = read_geojson(ROADS_SRC)
-
-    districts = normalize_districts(districts_raw)
-    fiber_nodes = normalize_fiber_nodes(fiber_nodes_raw)
-    franchise_zones = build_franchise_zones(districts, franchise_points_raw, fiber_nodes)
-    roads = normalize_roads(roads_raw)
-
-    write_geojson(DISTRICTS_OUT, districts)
-    write_geojson(FIBER_NODES_OUT, fiber_nodes)
-    write_geojson(FRANCHISE_ZONES_OUT, franchise_zones)
-    write_geojson(ROADS_OUT, roads)
-
-    print(f"Wrote {DISTRICTS_OUT} ({len(districts['features'])} features)")
-    print(f"Wrote {FIBER_NODES_OUT} ({len(fiber_nodes['features'])} features)")
-    print(f"Wrote {FRANCHISE_ZONES_OUT} ({len(franchise_zones['features'])} features)")
-    print(f"Wrote {ROADS_OUT} ({len(roads['features'])} features)")
+    args = parse_args()
+    manifest = load_manifest()
+
+    stage_sources = {
+        DISTRICTS_OUT: [DISTRICTS_SRC],
+        FIBER_NODES_OUT: [FIBER_NODES_SRC],
+        FRANCHISE_ZONES_OUT: [DISTRICTS_SRC, FRANCHISE_POINTS_SRC, FIBER_NODES_SRC],
+        ROADS_OUT: [ROADS_SRC],
+    }
+    stage_fingerprints = {out: stage_inputs(manifest, out, srcs) for out, srcs in stage_sources.items()}
+    stale = {
+        out for out, inputs in stage_fingerprints.items()
+        if args.force or not stage_is_current(manifest, out, inputs)
+    }
+
+    def run_stage(output: Path, build) -> None:
+        if output not in stale:
+            print(f"Skipped {output} (inputs unchanged)")
+            return
+        # Forget the old fingerprint first: if the rebuild fails, the next run
+        # must not treat the previous output as current.
+        if manifest.pop(str(output), None) is not None:
+            save_manifest(manifest)
+        count = write_geojson(output, build())
+        manifest[str(output)] = stage_fingerprints[output]
+        save_manifest(manifest)
+        print(f"Wrote {output} ({count} features)")
+
+    # Districts and fiber nodes are small and feed the zone builder, so they
+    # are materialized (only when a stage needs them); roads stream straight
+    # from source to output.
+    districts: List[dict] = []
+    fiber_nodes: List[dict] = []
+    if stale & {DISTRICTS_OUT, FRANCHISE_ZONES_OUT}:
+        districts = list(normalize_districts(iter_features(DISTRICTS_SRC)))
+    if stale & {FIBER_NODES_OUT, FRANCHISE_ZONES_OUT}:
+        fiber_nodes = list(normalize_fiber_nodes(iter_features(FIBER_NODES_SRC)))
+
+    run_stage(DISTRICTS_OUT, lambda: districts)
+    run_stage(FIBER_NODES_OUT, lambda: fiber_nodes)
+    run_stage(
+        FRANCHISE_ZONES_OUT,
+        lambda: build_franchise_zones(districts, iter_features(FRANCHISE_POINTS_SRC), fiber_nodes),
+    )
+    run_stage(ROADS_OUT, lambda: normalize_roads(iter_features(ROADS_SRC)))
 
 
 if __name__ == "__main__":
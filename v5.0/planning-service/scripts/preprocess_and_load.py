@@ -1,23 +1,81 @@
 import argparse
-import json
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 from pathlib import Path
-from typing import Any, Dict, Iterable, List
+from typing import Any, Dict, Iterable, List, Sequence, Tuple
 
+import ijson
 import psycopg
+import shapely
+from shapely.geometry import shape
 
 from app.config import settings
 
+# Rows per executemany() call when COPY is not available.
+INSERT_BATCH_SIZE = 1000
 
-def load_geojson(path: Path) -> Dict[str, Any]:
-    with path.open("r", encoding="utf-8") as f:
-        return json.load(f)
+# Transaction-local planner settings for the road/franchise overlay.
+PARALLEL_CLIP_SETTINGS = (
+    "SET LOCAL max_parallel_workers_per_gather = 8",
+    "SET LOCAL parallel_setup_cost = 0",
+    "SET LOCAL parallel_tuple_cost = 0",
+    "SET LOCAL min_parallel_table_scan_size = 0",
+    "SET LOCAL work_mem = '512MB'",
+)
 
+# Secondary road_edges indexes from sql/001_core_schema.sql, dropped for the
+# bulk load and rebuilt afterwards.
+ROAD_EDGE_INDEXES = (
+    ("idx_road_edges_geom", "CREATE INDEX idx_road_edges_geom ON road_edges USING GIST (geom)"),
+    ("idx_road_edges_franchise", "CREATE INDEX idx_road_edges_franchise ON road_edges (franchise_id)"),
+)
 
-def iter_features(geojson: Dict[str, Any]) -> Iterable[Dict[str, Any]]:
-    features = geojson.get("features", [])
-    for feature in features:
-        if feature and feature.get("geometry"):
-            yield feature
+
+def iter_features(path: Path) -> Iterable[Dict[str, Any]]:
+    # Stream features straight from disk so only one feature is held at a time.
+    with path.open("rb") as f:
+        for feature in ijson.items(f, "features.item", use_float=True):
+            if feature and feature.get("geometry"):
+                yield feature
+
+
+def geometry_ewkb(geometry: Dict[str, Any]) -> str:
+    # Parse GeoJSON on the client and ship hex EWKB, so the server only
+    # decodes binary instead of running ST_GeomFromGeoJSON per row.
+    return shapely.to_wkb(shapely.set_srid(shape(geometry), 4326), hex=True, include_srid=True)
+
+
+def stage_rows(
+    cur: psycopg.Cursor,
+    table: str,
+    columns: Sequence[str],
+    rows: Iterable[Tuple[Any, ...]],
+    use_copy: bool = True,
+) -> None:
+    """
+    Write rows into a staging table with COPY FROM STDIN, or with batched
+    executemany() for servers/proxies where COPY is not viable.
+    """
+    column_list = ", ".join(columns)
+    if use_copy:
+        with cur.copy(f"COPY {table} ({column_list}) FROM STDIN") as copy:
+            for row in rows:
+                copy.write_row(row)
+        return
+
+    placeholders = ", ".join(["%s"] * len(columns))
+    insert_sql = f"INSERT INTO {table} ({column_list}) VALUES ({placeholders})"
+    rows = iter(rows)
+    # psycopg pipelines the parameter sets of each executemany() call.
+    while batch := list(islice(rows, INSERT_BATCH_SIZE)):
+        cur.executemany(insert_sql, batch)
+
+
+def configure_bulk_session(conn: psycopg.Connection) -> None:
+    # A failed load is rerun from scratch, so the loader does not need to
+    # wait for each commit to reach disk.
+    conn.execute("SET synchronous_commit = off")
+    conn.commit()
 
 
 def run_schema(conn: psycopg.Connection, schema_path: Path) -> None:
@@ -27,132 +85,228 @@ def run_schema(conn: psycopg.Connection, schema_path: Path) -> None:
     conn.commit()
 
 
-def load_districts(conn: psycopg.Connection, districts_geojson: Path) -> None:
-    payload = load_geojson(districts_geojson)
+def bump_dataset_version(conn: psycopg.Connection) -> None:
+    # Running services drop their cached routes once they see the new version.
+    with conn.cursor() as cur:
+        cur.execute("UPDATE dataset_version SET version = version + 1, loaded_at = NOW()")
+    conn.commit()
+
+
+def district_rows(path: Path) -> Iterable[Tuple[Any, ...]]:
+    for feature in iter_features(path):
+        props = feature.get("properties", {})
+        district_id = props.get("district_id") or props.get("id") or props.get("name")
+        name = props.get("name") or district_id
+        yield district_id, name, geometry_ewkb(feature["geometry"])
+
+
+def load_districts(conn: psycopg.Connection, districts_geojson: Path, use_copy: bool = True) -> None:
     with conn.cursor() as cur:
         cur.execute("TRUNCATE districts CASCADE")
-        for feature in iter_features(payload):
-            props = feature.get("properties", {})
-            district_id = props.get("district_id") or props.get("id") or props.get("name")
-            name = props.get("name") or district_id
-            geom = json.dumps(feature["geometry"])
-            cur.execute(
-                """
-                INSERT INTO districts (district_id, name, geom)
-                VALUES (%s, %s, ST_Multi(ST_SetSRID(ST_GeomFromGeoJSON(%s), 4326)))
-                """,
-                (district_id, name, geom),
-            )
+        cur.execute(
+            """
+            CREATE TEMP TABLE _districts_stage (
+                district_id TEXT,
+                name TEXT,
+                geom geometry(Geometry, 4326)
+            ) ON COMMIT DROP
+            """
+        )
+        stage_rows(cur, "_districts_stage", ("district_id", "name", "geom"), district_rows(districts_geojson), use_copy)
+        cur.execute(
+            """
+            INSERT INTO districts (district_id, name, geom)
+            SELECT district_id, name, ST_Multi(geom)
+            FROM _districts_stage
+            """
+        )
     conn.commit()
 
 
-def load_franchises(conn: psycopg.Connection, franchises_geojson: Path) -> None:
-    payload = load_geojson(franchises_geojson)
+def franchise_rows(path: Path) -> Iterable[Tuple[Any, ...]]:
+    for feature in iter_features(path):
+        props = feature.get("properties", {})
+        franchise_id = props.get("franchise_id") or props.get("id")
+        district_id = props.get("district_id")
+        if not franchise_id or not district_id:
+            raise ValueError("Each franchise feature needs franchise_id and district_id.")
+        assigned_node_ids = props.get("assigned_node_ids", [])
+        if not isinstance(assigned_node_ids, list):
+            assigned_node_ids = []
+        yield franchise_id, district_id, assigned_node_ids, geometry_ewkb(feature["geometry"])
+
+
+def load_franchises(conn: psycopg.Connection, franchises_geojson: Path, use_copy: bool = True) -> None:
     with conn.cursor() as cur:
         cur.execute("TRUNCATE franchise_zones CASCADE")
-        for feature in iter_features(payload):
-            props = feature.get("properties", {})
-            franchise_id = props.get("franchise_id") or props.get("id")
-            district_id = props.get("district_id")
-            if not franchise_id or not district_id:
-                raise ValueError("Each franchise feature needs franchise_id and district_id.")
-            assigned_node_ids = props.get("assigned_node_ids", [])
-            if not isinstance(assigned_node_ids, list):
-                assigned_node_ids = []
-            geom = json.dumps(feature["geometry"])
-            cur.execute(
-                """
-                INSERT INTO franchise_zones (franchise_id, district_id, assigned_node_ids, geom)
-                VALUES (
-                    %s,
-                    %s,
-                    %s,
-                    ST_Multi(
-                        ST_CollectionExtract(
-                            ST_SetSRID(ST_GeomFromGeoJSON(%s), 4326),
-                            3
-                        )
-                    )
-                )
-                """,
-                (franchise_id, district_id, assigned_node_ids, geom),
-            )
+        cur.execute(
+            """
+            CREATE TEMP TABLE _franchises_stage (
+                franchise_id TEXT,
+                district_id TEXT,
+                assigned_node_ids TEXT[],
+                geom geometry(Geometry, 4326)
+            ) ON COMMIT DROP
+            """
+        )
+        stage_rows(
+            cur,
+            "_franchises_stage",
+            ("franchise_id", "district_id", "assigned_node_ids", "geom"),
+            franchise_rows(franchises_geojson),
+            use_copy,
+        )
+        cur.execute(
+            """
+            INSERT INTO franchise_zones (franchise_id, district_id, assigned_node_ids, geom)
+            SELECT
+                franchise_id,
+                district_id,
+                assigned_node_ids,
+                ST_Multi(ST_CollectionExtract(geom, 3))
+            FROM _franchises_stage
+            """
+        )
+        cur.execute(
+            """
+            INSERT INTO franchise_zones_sub (franchise_id, geom)
+            SELECT franchise_id, ST_Subdivide(geom, 256)::geometry(Polygon, 4326)
+            FROM franchise_zones
+            """
+        )
     conn.commit()
 
 
-def load_fiber_nodes(conn: psycopg.Connection, nodes_geojson: Path) -> None:
-    payload = load_geojson(nodes_geojson)
+def fiber_node_rows(path: Path) -> Iterable[Tuple[Any, ...]]:
+    for feature in iter_features(path):
+        props = feature.get("properties", {})
+        node_id = props.get("node_id") or props.get("id")
+        franchise_id = props.get("franchise_id")
+        if not node_id or not franchise_id:
+            raise ValueError("Each fiber node feature needs node_id and franchise_id.")
+        capacity = props.get("capacity")
+        status = props.get("status", "active")
+        yield node_id, franchise_id, capacity, status, geometry_ewkb(feature["geometry"])
+
+
+def load_fiber_nodes(conn: psycopg.Connection, nodes_geojson: Path, use_copy: bool = True) -> None:
     with conn.cursor() as cur:
         cur.execute("TRUNCATE fiber_nodes CASCADE")
-        for feature in iter_features(payload):
-            props = feature.get("properties", {})
-            node_id = props.get("node_id") or props.get("id")
-            franchise_id = props.get("franchise_id")
-            if not node_id or not franchise_id:
-                raise ValueError("Each fiber node feature needs node_id and franchise_id.")
-            capacity = props.get("capacity")
-            status = props.get("status", "active")
-            geom = json.dumps(feature["geometry"])
-            cur.execute(
-                """
-                INSERT INTO fiber_nodes (node_id, franchise_id, capacity, status, geom)
-                VALUES (%s, %s, %s, %s, ST_SetSRID(ST_GeomFromGeoJSON(%s), 4326))
-                """,
-                (node_id, franchise_id, capacity, status, geom),
-            )
+        cur.execute(
+            """
+            CREATE TEMP TABLE _fiber_nodes_stage (
+                node_id TEXT,
+                franchise_id TEXT,
+                capacity NUMERIC,
+                status TEXT,
+                geom geometry(Geometry, 4326)
+            ) ON COMMIT DROP
+            """
+        )
+        stage_rows(
+            cur,
+            "_fiber_nodes_stage",
+            ("node_id", "franchise_id", "capacity", "status", "geom"),
+            fiber_node_rows(nodes_geojson),
+            use_copy,
+        )
+        cur.execute(
+            """
+            INSERT INTO fiber_nodes (node_id, franchise_id, capacity, status, geom)
+            SELECT node_id, franchise_id, capacity, status, geom
+            FROM _fiber_nodes_stage
+            """
+        )
     conn.commit()
 
 
-def load_and_clip_roads(conn: psycopg.Connection, roads_geojson: Path) -> None:
-    payload = load_geojson(roads_geojson)
+def load_and_clip_roads(conn: psycopg.Connection, roads_geojson: Path, use_copy: bool = True) -> None:
     with conn.cursor() as cur:
+        # _road_edges_raw is an UNLOGGED regular table rather than a TEMP one:
+        # parallel workers cannot read another backend's temp tables.
         cur.execute(
             """
             DROP TABLE IF EXISTS _road_edges_raw;
-            CREATE TEMP TABLE _road_edges_raw (
+            DROP TABLE IF EXISTS _road_edges_clipped;
+            CREATE UNLOGGED TABLE _road_edges_raw (
+                geom geometry(LineString, 4326)
+            );
+            CREATE TEMP TABLE _road_edges_stage (
                 geom geometry(Geometry, 4326)
             ) ON COMMIT DROP;
             """
         )
-        for feature in iter_features(payload):
-            geom = json.dumps(feature["geometry"])
-            cur.execute(
-                """
-                INSERT INTO _road_edges_raw (geom)
-                VALUES (ST_SetSRID(ST_GeomFromGeoJSON(%s), 4326))
-                """,
-                (geom,),
-            )
+        stage_rows(
+            cur,
+            "_road_edges_stage",
+            ("geom",),
+            ((geometry_ewkb(feature["geometry"]),) for feature in iter_features(roads_geojson)),
+            use_copy,
+        )
+        # Break roads into single LineStrings of at most 256 vertices up front:
+        # short pieces mostly fall entirely inside one franchise and take the
+        # ST_CoveredBy fast path below instead of a full ST_Intersection.
+        cur.execute(
+            """
+            INSERT INTO _road_edges_raw (geom)
+            SELECT ST_Subdivide(part.geom, 256)
+            FROM _road_edges_stage s
+            CROSS JOIN LATERAL ST_Dump(ST_CollectionExtract(s.geom, 2)) AS part
+            """
+        )
+        # Index and analyze the freshly filled table so the franchise
+        # join below is index-driven instead of comparing every raw edge
+        # against every franchise polygon.
+        cur.execute("CREATE INDEX ON _road_edges_raw USING GIST (geom)")
+        cur.execute("ANALYZE _road_edges_raw")
+        cur.execute("ANALYZE franchise_zones")
 
-        cur.execute("TRUNCATE road_edges CASCADE")
+        # The overlay is CPU-bound GEOS work. INSERT ... SELECT never runs in
+        # parallel, but CREATE TABLE AS does, so clip into a scratch table
+        # with parallel workers and copy the result over afterwards.
+        for setting in PARALLEL_CLIP_SETTINGS:
+            cur.execute(setting)
         cur.execute(
             """
-            INSERT INTO road_edges (source, target, length_m, cost, franchise_id, geom)
+            CREATE UNLOGGED TABLE _road_edges_clipped AS
             SELECT
-                NULL::bigint AS source,
-                NULL::bigint AS target,
-                ST_Length(clipped.geom::geography) AS length_m,
-                ST_Length(clipped.geom::geography) AS cost,
                 f.franchise_id,
-                clipped.geom
+                clipped.geom,
+                ST_Length(clipped.geom::geography) AS length_m
             FROM franchise_zones f
             JOIN _road_edges_raw r ON ST_Intersects(r.geom, f.geom)
             CROSS JOIN LATERAL (
+                -- Pieces entirely inside the franchise skip the GEOS overlay;
+                -- only boundary pieces are intersected and dumped.
                 SELECT (
                     ST_Dump(
-                        ST_CollectionExtract(
-                            ST_Intersection(
-                                ST_CollectionExtract(r.geom, 2),
-                                f.geom
-                            ),
-                            2
-                        )
+                        CASE
+                            WHEN ST_CoveredBy(r.geom, f.geom) THEN r.geom
+                            ELSE ST_CollectionExtract(ST_Intersection(r.geom, f.geom), 2)
+                        END
                     )
                 ).geom::geometry(LineString, 4326) AS geom
             ) AS clipped
-            WHERE ST_Length(clipped.geom::geography) > 0.5
             """
         )
+
+        # Load road_edges without its secondary indexes and build them once at the end.
+        cur.execute("TRUNCATE road_edges CASCADE")
+        for index_name, _ in ROAD_EDGE_INDEXES:
+            cur.execute(f"DROP INDEX IF EXISTS {index_name}")
+        cur.execute(
+            """
+            INSERT INTO road_edges (source, target, length_m, cost, franchise_id, geom)
+            SELECT NULL::bigint, NULL::bigint, length_m, length_m, franchise_id, geom
+            FROM _road_edges_clipped
+            WHERE length_m > 0.5
+            """
+        )
+        for _, create_sql in ROAD_EDGE_INDEXES:
+            cur.execute(create_sql)
+        cur.execute("ANALYZE road_edges")
+        cur.execute("DROP TABLE _road_edges_clipped")
+        cur.execute("DROP TABLE _road_edges_raw")
     conn.commit()
 
 
@@ -161,7 +315,21 @@ def build_topology(conn: psycopg.Connection, tolerance: float) -> None:
         # pgRouting 4.x no longer exposes pgr_createTopology.
         # Build graph topology by snapping edge endpoints to a tolerance grid,
         # creating unique vertex ids, and backfilling source/target.
+        # Endpoints are snapped once per edge and reused for both vertex
+        # discovery and the source/target backfill.
+        cur.execute("DROP TABLE IF EXISTS _edge_snaps")
         cur.execute("DROP TABLE IF EXISTS _vertices")
+        cur.execute(
+            """
+            CREATE TEMP TABLE _edge_snaps AS
+            SELECT
+                edge_id,
+                ST_SnapToGrid(ST_StartPoint(geom), %s) AS sp,
+                ST_SnapToGrid(ST_EndPoint(geom), %s) AS ep
+            FROM road_edges
+            """,
+            (tolerance, tolerance),
+        )
         cur.execute(
             """
             CREATE TEMP TABLE _vertices AS
@@ -169,33 +337,23 @@ def build_topology(conn: psycopg.Connection, tolerance: float) -> None:
                 ROW_NUMBER() OVER (ORDER BY ST_AsBinary(geom))::bigint AS node_id,
                 geom
             FROM (
-                SELECT DISTINCT ST_SnapToGrid(ST_StartPoint(geom), %s) AS geom
-                FROM road_edges
+                SELECT sp AS geom FROM _edge_snaps
                 UNION
-                SELECT DISTINCT ST_SnapToGrid(ST_EndPoint(geom), %s) AS geom
-                FROM road_edges
+                SELECT ep AS geom FROM _edge_snaps
             ) v
-            """,
-            (tolerance, tolerance),
-        )
-        cur.execute("CREATE INDEX ON _vertices USING GIST (geom)")
-        cur.execute(
             """
-            UPDATE road_edges e
-            SET source = v.node_id
-            FROM _vertices v
-            WHERE ST_SnapToGrid(ST_StartPoint(e.geom), %s) = v.geom
-            """,
-            (tolerance,),
         )
+        cur.execute("CREATE INDEX ON _vertices (geom)")
         cur.execute(
             """
             UPDATE road_edges e
-            SET target = v.node_id
-            FROM _vertices v
-            WHERE ST_SnapToGrid(ST_EndPoint(e.geom), %s) = v.geom
-            """,
-            (tolerance,),
+            SET source = vs.node_id,
+                target = ve.node_id
+            FROM _edge_snaps s
+            JOIN _vertices vs ON vs.geom = s.sp
+            JOIN _vertices ve ON ve.geom = s.ep
+            WHERE e.edge_id = s.edge_id
+            """
         )
         cur.execute("TRUNCATE road_nodes")
         cur.execute(
@@ -215,6 +373,14 @@ def build_topology(conn: psycopg.Connection, tolerance: float) -> None:
     conn.commit()
 
 
+def run_on_new_connection(database_url: str, loader, *args) -> None:
+    # psycopg connections must not be shared across threads; each concurrent
+    # loader gets its own.
+    with psycopg.connect(database_url) as conn:
+        configure_bulk_session(conn)
+        loader(conn, *args)
+
+
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="Load and preprocess Tamil Nadu planning data into PostGIS.")
     parser.add_argument("--districts", required=True, help="Path to districts GeoJSON")
@@ -237,6 +403,11 @@ def parse_args() -> argparse.Namespace:
         type=float,
         help="Tolerance used by pgr_createTopology in degrees",
     )
+    parser.add_argument(
+        "--no-copy",
+        action="store_true",
+        help="Stage rows with batched INSERTs instead of COPY (e.g. behind proxies without COPY support)",
+    )
     return parser.parse_args()
 
 
@@ -249,12 +420,21 @@ def main() -> None:
     roads_path = Path(args.roads)
 
     with psycopg.connect(args.database_url) as conn:
+        configure_bulk_session(conn)
         run_schema(conn, schema_path)
-        load_districts(conn, districts_path)
-        load_franchises(conn, franchises_path)
-        load_fiber_nodes(conn, fiber_nodes_path)
-        load_and_clip_roads(conn, roads_path)
+        use_copy = not args.no_copy
+        # Franchises reference districts, so these two stay sequential.
+        load_districts(conn, districts_path, use_copy)
+        load_franchises(conn, franchises_path, use_copy)
+        # Fiber nodes and roads only depend on franchises; load them side by side.
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="loader") as executor:
+            fiber_nodes_loaded = executor.submit(
+                run_on_new_connection, args.database_url, load_fiber_nodes, fiber_nodes_path, use_copy
+            )
+            load_and_clip_roads(conn, roads_path, use_copy)
+            fiber_nodes_loaded.result()
         build_topology(conn, args.topology_tolerance)
+        bump_dataset_version(conn)
 
     print("Data load and preprocessing completed.")
 
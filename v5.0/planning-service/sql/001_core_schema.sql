@@ -1,5 +1,6 @@
 CREATE EXTENSION IF NOT EXISTS postgis;
 CREATE EXTENSION IF NOT EXISTS pgrouting;
+CREATE EXTENSION IF NOT EXISTS btree_gist;
 
 CREATE TABLE IF NOT EXISTS districts (
     district_id TEXT PRIMARY KEY,
@@ -14,6 +15,22 @@ CREATE TABLE IF NOT EXISTS franchise_zones (
     geom geometry(MultiPolygon, 4326) NOT NULL
 );
 
+-- Franchise polygons cut into <=256-vertex pieces; point-in-franchise lookups
+-- run against these so containment tests never touch the full polygon.
+CREATE TABLE IF NOT EXISTS franchise_zones_sub (
+    franchise_id TEXT NOT NULL REFERENCES franchise_zones(franchise_id) ON DELETE CASCADE,
+    geom geometry(Polygon, 4326) NOT NULL
+);
+
+-- Single row bumped by the loader after every load; the service keys its
+-- route cache on the version so results from older data are never served.
+CREATE TABLE IF NOT EXISTS dataset_version (
+    singleton BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (singleton),
+    version BIGINT NOT NULL DEFAULT 0,
+    loaded_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+INSERT INTO dataset_version DEFAULT VALUES ON CONFLICT DO NOTHING;
+
 CREATE TABLE IF NOT EXISTS fiber_nodes (
     node_id TEXT PRIMARY KEY,
     franchise_id TEXT NOT NULL REFERENCES franchise_zones(franchise_id) ON DELETE CASCADE,
@@ -41,8 +58,14 @@ CREATE TABLE IF NOT EXISTS road_nodes (
 
 CREATE INDEX IF NOT EXISTS idx_districts_geom ON districts USING GIST (geom);
 CREATE INDEX IF NOT EXISTS idx_franchise_geom ON franchise_zones USING GIST (geom);
+CREATE INDEX IF NOT EXISTS idx_franchise_sub_geom ON franchise_zones_sub USING GIST (geom);
 CREATE INDEX IF NOT EXISTS idx_fiber_nodes_geom ON fiber_nodes USING GIST (geom);
 CREATE INDEX IF NOT EXISTS idx_road_edges_geom ON road_edges USING GIST (geom);
 CREATE INDEX IF NOT EXISTS idx_road_nodes_geom ON road_nodes USING GIST (geom);
 CREATE INDEX IF NOT EXISTS idx_road_edges_franchise ON road_edges (franchise_id);
 CREATE INDEX IF NOT EXISTS idx_road_nodes_franchise ON road_nodes (franchise_id);
+-- Composite (franchise_id, geom) GiST indexes let the per-franchise KNN
+-- lookups (WHERE franchise_id = ... ORDER BY geom <-> ...) run as a single
+-- index-ordered scan instead of filter + sort.
+CREATE INDEX IF NOT EXISTS idx_fiber_nodes_franchise_geom ON fiber_nodes USING GIST (franchise_id, geom);
+CREATE INDEX IF NOT EXISTS idx_road_nodes_franchise_geom ON road_nodes USING GIST (franchise_id, geom);